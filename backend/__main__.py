@@ -0,0 +1,17 @@
+"""Entry point for ``python -m backend``, run from the repository root.
+
+    python -m backend serve --workers 4
+    python -m backend export --format csv --output sessions.csv
+"""
+import sys
+from pathlib import Path
+
+# The backend modules import each other as top-level modules, as they do
+# when uvicorn runs ``server:app`` from this directory
+sys.path.insert(0, str(Path(__file__).parent))
+
+from cli import app  # noqa: E402
+
+# Guarded because compute pool processes re-import the main module
+if __name__ == "__main__":
+    app(prog_name="python -m backend")
@@ -0,0 +1,184 @@
+"""In-process load test for the API.
+
+Runs the FastAPI ``app`` through httpx's ASGI transport (no network, no
+uvicorn) and drives complete game sessions:
+
+    bootstrap -> one decision per character -> calculate-outcome x N -> get state
+
+Reports throughput plus p50/p95/p99 latency per route and can compare the
+run with a saved JSON baseline, exiting non-zero on regressions.
+
+    cd backend
+    python benchmark.py --sessions 2000 --concurrency 50 --save-baseline baseline.json
+    python benchmark.py --sessions 2000 --concurrency 50 --baseline baseline.json
+
+The in-memory session store is used unless ``--store mongo`` is given, in
+which case MONGO_URL / DB_NAME from the environment apply.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, route: str, request):
+        start = time.perf_counter()
+        response = await request
+        self.samples[route].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            ms = np.array(samples) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "throughput_rps": len(samples) / elapsed,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+            }
+        total = sum(len(s) for s in self.samples.values())
+        return {
+            "elapsed_seconds": elapsed,
+            "total_requests": total,
+            "throughput_rps": total / elapsed,
+            "routes": routes,
+        }
+
+
+async def run_session(client, recorder: LatencyRecorder, outcomes_per_session: int):
+    session_id = str(uuid.uuid4())
+    response = await recorder.call(
+        "POST /api/bootstrap",
+        client.post("/api/bootstrap", json={"session_id": session_id}),
+    )
+    data = response.json()
+    plan_ids = [plan["id"] for plan in data["insurance_options"]]
+    scenario_ids = [scenario["id"] for scenario in data["scenarios"]]
+
+    for character in data["characters"]:
+        await recorder.call(
+            "POST /api/game/decision",
+            client.post("/api/game/decision", json={
+                "session_id": session_id,
+                "decision": {"character_id": character["id"], "insurance_option_id": random.choice(plan_ids)},
+            }),
+        )
+
+    for scenario_id in random.sample(scenario_ids, min(outcomes_per_session, len(scenario_ids))):
+        await recorder.call(
+            "POST /api/game/calculate-outcome",
+            client.post("/api/game/calculate-outcome", params={"session_id": session_id, "scenario_id": scenario_id}),
+        )
+
+    await recorder.call("GET /api/game/{session_id}", client.get(f"/api/game/{session_id}"))
+
+
+async def run_benchmark(sessions: int, concurrency: int, outcomes_per_session: int) -> dict:
+    from server import app
+
+    recorder = LatencyRecorder()
+    remaining = iter(range(sessions))
+
+    async def worker(client):
+        for _ in remaining:
+            await run_session(client, recorder, outcomes_per_session)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+    return recorder.report(elapsed)
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Routes whose p95 grew or throughput dropped by more than ``tolerance``."""
+    regressions = []
+    for route, base in baseline.get("routes", {}).items():
+        current = report["routes"].get(route)
+        if current is None:
+            regressions.append(f"{route}: missing from this run")
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {current['p95_ms']:.2f}ms vs baseline {base['p95_ms']:.2f}ms")
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{route}: {current['errors']} errors vs baseline {base.get('errors', 0)}")
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {report['throughput_rps']:.0f} rps vs baseline {baseline['throughput_rps']:.0f} rps"
+        )
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{report['total_requests']} requests in {report['elapsed_seconds']:.2f}s "
+          f"({report['throughput_rps']:.0f} req/s)")
+    print(f"{'route':<36}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in report["routes"].items():
+        print(f"{route:<36}{stats['requests']:>8}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000, help="game sessions to play")
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions in flight at once")
+    parser.add_argument("--outcomes", type=int, default=3, help="calculate-outcome calls per session")
+    parser.add_argument("--store", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--seed", type=int, default=0, help="seed for plan/scenario choices")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--save-baseline", help="write this run's report to the given path")
+    args = parser.parse_args(argv)
+
+    # Must be set before server is imported
+    os.environ["SESSION_STORE"] = args.store
+    random.seed(args.seed)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report = asyncio.run(run_benchmark(args.sessions, args.concurrency, args.outcomes))
+    report["config"] = {"sessions": args.sessions, "concurrency": args.concurrency, "outcomes": args.outcomes,
+                        "store": args.store}
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""In-memory game catalog with lookup indexes.
+
+Insurance options, characters and scenarios are loaded once and indexed by
+id and by the scenario attributes the API filters on, so handlers never
+scan the full lists.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def _index_by(items: Iterable[T], attr: str) -> Dict[str, List[T]]:
+    index: Dict[str, List[T]] = {}
+    for item in items:
+        index.setdefault(getattr(item, attr), []).append(item)
+    return index
+
+
+class Catalog:
+    """Immutable snapshot of the catalog plus its derived indexes."""
+
+    def __init__(
+        self,
+        insurance_options: Sequence,
+        characters: Sequence,
+        scenarios: Sequence,
+        version: Optional[str] = None,
+    ):
+        self.version = version
+        self.insurance_options = list(insurance_options)
+        self.characters = list(characters)
+        self.scenarios = list(scenarios)
+
+        self.insurance_options_by_id = {ins.id: ins for ins in self.insurance_options}
+        self.characters_by_id = {c.id: c for c in self.characters}
+        self.scenarios_by_id = {s.id: s for s in self.scenarios}
+
+        self.scenarios_by_category = _index_by(self.scenarios, "category")
+        self.scenarios_by_urgency = _index_by(self.scenarios, "urgency_level")
+        self.scenarios_by_age_relevance = _index_by(self.scenarios, "age_relevance")
+        self._scenario_indexes = {
+            "category": self.scenarios_by_category,
+            "urgency_level": self.scenarios_by_urgency,
+            "age_relevance": self.scenarios_by_age_relevance,
+        }
+
+    def get_insurance_option(self, option_id: str):
+        return self.insurance_options_by_id.get(option_id)
+
+    def get_character(self, character_id: str):
+        return self.characters_by_id.get(character_id)
+
+    def get_scenario(self, scenario_id: str):
+        return self.scenarios_by_id.get(scenario_id)
+
+    def filter_scenarios(
+        self,
+        category: Optional[str] = None,
+        urgency_level: Optional[str] = None,
+        age_relevance: Optional[str] = None,
+    ) -> list:
+        """Scenarios matching every given attribute, in catalog order."""
+        wanted = {
+            attr: value
+            for attr, value in (("category", category), ("urgency_level", urgency_level), ("age_relevance", age_relevance))
+            if value is not None
+        }
+        if not wanted:
+            return self.scenarios
+
+        # Start from the smallest matching bucket (already in catalog order) and check the rest per item
+        candidates = min((self._scenario_indexes[attr].get(value, []) for attr, value in wanted.items()), key=len)
+        return [s for s in candidates if all(getattr(s, attr) == value for attr, value in wanted.items())]
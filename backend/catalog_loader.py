@@ -0,0 +1,223 @@
+"""Loading the game catalog from files or MongoDB, with hot reload.
+
+A catalog is one document with ``insurance_options``, ``characters`` and
+``scenarios`` lists, validated into the models in ``models.py``. It comes
+from a JSON or YAML file (``CATALOG_PATH``, by default ``catalog.json`` next
+to this module) or, with ``CATALOG_SOURCE=mongo``, from the ``active``
+document of the ``catalog`` collection.
+
+``CatalogWatcher`` checks the source every ``CATALOG_RELOAD_SECONDS`` (or
+follows a change stream when Mongo runs as a replica set) and hands each
+new, valid version to a callback. Invalid versions are logged and skipped,
+so the running catalog is only ever replaced by a complete one.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from catalog import Catalog
+from models import Character, InsuranceOption, Scenario
+from session_store import mongo_client_options
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = Path(__file__).parent / "catalog.json"
+CATALOG_DOCUMENT_ID = "active"
+
+
+def catalog_version(data: dict) -> str:
+    """Content hash identifying a catalog document."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def parse_catalog(data: dict) -> Catalog:
+    """Validate a catalog document; raises ValueError if it is incomplete or invalid."""
+    sections = {}
+    for name, model in (("insurance_options", InsuranceOption), ("characters", Character), ("scenarios", Scenario)):
+        items = data.get(name)
+        if not isinstance(items, list) or not items:
+            raise ValueError(f"catalog needs a non-empty {name!r} list")
+        sections[name] = [model.model_validate(item) for item in items]
+        ids = [item.id for item in sections[name]]
+        duplicates = sorted({i for i in ids if ids.count(i) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate ids in {name!r}: {', '.join(duplicates)}")
+    # The plan comparison shows the first two options side by side
+    if len(sections["insurance_options"]) < 2:
+        raise ValueError("catalog needs at least two insurance options")
+    return Catalog(version=catalog_version(data), **sections)
+
+
+def read_catalog_file(path) -> dict:
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix in (".yaml", ".yml"):
+        if yaml is None:
+            raise RuntimeError("PyYAML is required to read YAML catalogs")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def load_catalog_file(path) -> Catalog:
+    return parse_catalog(read_catalog_file(path))
+
+
+class FileCatalogSource:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._mtime_ns: Optional[int] = None
+
+    def __str__(self):
+        return str(self.path)
+
+    async def load(self) -> Optional[dict]:
+        """The file's contents, or None if it has not been modified since the last load."""
+        mtime_ns = self.path.stat().st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return None
+        data = await asyncio.to_thread(read_catalog_file, self.path)
+        self._mtime_ns = mtime_ns
+        return data
+
+    async def close(self):
+        pass
+
+
+class MongoCatalogSource:
+    """The catalog document in ``db``; ``client`` is closed with the source if given."""
+
+    def __init__(self, db, document_id: str = CATALOG_DOCUMENT_ID, client=None):
+        self.client = client
+        self.collection = db.catalog
+        self.document_id = document_id
+
+    def __str__(self):
+        return f"{self.collection.full_name}/{self.document_id}"
+
+    async def load(self) -> Optional[dict]:
+        document = await self.collection.find_one({"_id": self.document_id})
+        if document is None:
+            return None
+        document.pop("_id")
+        return document
+
+    async def watch(self, on_change: Callable[[], Awaitable]):
+        """Call ``on_change`` for every write to the catalog document.
+
+        Raises OperationFailure on servers without change streams.
+        """
+        pipeline = [{"$match": {"documentKey._id": self.document_id}}]
+        async with self.collection.watch(pipeline) as stream:
+            async for _ in stream:
+                await on_change()
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+class CatalogWatcher:
+    def __init__(
+        self,
+        source,
+        on_change: Callable[[Catalog], Awaitable],
+        poll_interval: float = 10.0,
+        version: Optional[str] = None,
+    ):
+        self.source = source
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.version = version
+        self._task: Optional[asyncio.Task] = None
+
+    async def check(self) -> bool:
+        """Load the source and apply it if it holds a new, valid catalog."""
+        try:
+            data = await self.source.load()
+            if data is None:
+                return False
+            version = catalog_version(data)
+            if version == self.version:
+                return False
+            new_catalog = await asyncio.to_thread(parse_catalog, data)
+        except Exception:
+            logger.exception(f"Could not load catalog from {self.source}; keeping version {self.version}")
+            return False
+
+        await self.on_change(new_catalog)
+        self.version = version
+        logger.info(f"Catalog version {version} loaded from {self.source}")
+        return True
+
+    async def _run(self):
+        use_change_stream = hasattr(self.source, "watch")
+        while True:
+            try:
+                if use_change_stream:
+                    try:
+                        await self.source.watch(self.check)
+                    except OperationFailure as e:
+                        # Standalone servers have no change streams; poll instead
+                        logger.info(f"Catalog change stream unavailable ({e}); polling every {self.poll_interval}s")
+                        use_change_stream = False
+                    continue
+                await asyncio.sleep(self.poll_interval)
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Catalog watcher failed; retrying")
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        """Apply the current catalog, then watch for changes if a poll interval is set."""
+        await self.check()
+        if self.poll_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.source.close()
+
+
+def create_catalog_watcher(on_change, version: Optional[str] = None, environ=os.environ, db=None) -> CatalogWatcher:
+    """Build the watcher for the source selected by ``CATALOG_SOURCE`` ("file" or "mongo").
+
+    A Mongo source reads from ``db`` when given, e.g. the session store's,
+    instead of opening a client of its own.
+    """
+    source_name = environ.get('CATALOG_SOURCE', 'file').lower()
+    if source_name == 'file':
+        source = FileCatalogSource(environ.get('CATALOG_PATH', str(DEFAULT_CATALOG_PATH)))
+    elif source_name == 'mongo' and db is not None:
+        source = MongoCatalogSource(db)
+    elif source_name == 'mongo':
+        client = AsyncIOMotorClient(environ['MONGO_URL'], **mongo_client_options(environ))
+        source = MongoCatalogSource(client[environ['DB_NAME']], client=client)
+    else:
+        raise ValueError(f"Unknown CATALOG_SOURCE {source_name!r}; expected 'file' or 'mongo'")
+    return CatalogWatcher(
+        source,
+        on_change,
+        poll_interval=float(environ.get('CATALOG_RELOAD_SECONDS', '10')),
+        version=version,
+    )
@@ -0,0 +1,202 @@
+"""Command line tools for the game backend.
+
+    cd backend
+    python cli.py serve
+    SESSION_CACHE=off python cli.py serve --workers 4
+    python cli.py export --format csv --output sessions.csv
+    python cli.py export --format csv --output sessions.csv --resume
+    python cli.py publish-catalog catalog.yaml
+
+The same commands are available as ``python -m backend ...`` from the
+repository root.
+"""
+import asyncio
+import importlib.util
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import typer
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import catalog_loader
+import export
+from session_store import mongo_client_options, read_sessions, supports_multiple_workers
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+app = typer.Typer()
+
+
+@app.callback()
+def main():
+    """MediShield Story Game backend tools."""
+
+
+@app.command()
+def serve(
+    host: str = typer.Option("0.0.0.0", help="Interface to bind."),
+    port: int = typer.Option(8001, help="Port to bind."),
+    workers: int = typer.Option(
+        int(os.environ.get("WEB_CONCURRENCY", "1")),
+        help="Worker processes (default $WEB_CONCURRENCY or 1); more than 1 needs SESSION_CACHE=off.",
+    ),
+    log_level: str = typer.Option("info", help="Uvicorn log level."),
+):
+    """Run the API with uvicorn, using uvloop and httptools when installed."""
+    import uvicorn
+
+    if workers > 1 and not supports_multiple_workers():
+        # Workers share one listening socket, so requests for a session land
+        # on any of them, and each would serve and write its own stale copy
+        raise typer.BadParameter(
+            "sessions are held in a per-process cache (or in memory), which workers cannot share; "
+            "set SESSION_STORE=mongo and SESSION_CACHE=off, or run one worker",
+            param_hint="--workers",
+        )
+
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    typer.echo(f"Starting {workers} worker(s) on {host}:{port} (loop={loop}, http={http})", err=True)
+    # Each worker imports server:app itself and connects to Mongo in the
+    # app's lifespan handler, so no connection is shared across processes
+    uvicorn.run(
+        "server:app",
+        app_dir=str(ROOT_DIR),
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        log_level=log_level,
+        proxy_headers=True,
+    )
+
+
+async def _publish_catalog(data: dict):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], **mongo_client_options())
+    try:
+        # One document, replaced whole, so watchers never see a partial catalog
+        await client[os.environ['DB_NAME']].catalog.replace_one(
+            {"_id": catalog_loader.CATALOG_DOCUMENT_ID}, data, upsert=True
+        )
+    finally:
+        client.close()
+
+
+@app.command("publish-catalog")
+def publish_catalog(path: Path = typer.Argument(..., exists=True, dir_okay=False, help="JSON or YAML catalog file.")):
+    """Validate a catalog file and make it the active catalog in MongoDB."""
+    data = catalog_loader.read_catalog_file(path)
+    try:
+        new_catalog = catalog_loader.parse_catalog(data)
+    except ValueError as e:
+        typer.echo(f"Invalid catalog: {e}", err=True)
+        raise typer.Exit(1)
+    asyncio.run(_publish_catalog(data))
+    typer.echo(f"Published catalog version {new_catalog.version}", err=True)
+
+
+def _last_complete_line(path: Path, block_size: int = 65536, remove: bool = False) -> Optional[str]:
+    """Last newline-terminated line of a file, dropping any partial trailing write.
+
+    With ``remove`` the returned line is truncated away too. Reads backwards
+    from the end so large exports are never loaded whole.
+    """
+    with open(path, "rb+") as f:
+        size = f.seek(0, 2)
+        tail = b""
+        position = size
+        # Read until the tail holds a full line plus the newline before it
+        while position > 0 and tail.count(b"\n") < 2:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+
+        end = tail.rfind(b"\n")
+        if end < 0:
+            f.truncate(0)
+            return None
+        if end != len(tail) - 1:
+            f.truncate(position + end + 1)
+        start = tail.rfind(b"\n", 0, end) + 1
+        if remove:
+            f.truncate(position + start)
+        return tail[start:end].decode("utf-8")
+
+
+def _is_csv_header(line: str) -> bool:
+    return line.startswith("session_id,")
+
+
+def _rewind_csv_session(path: Path, last_line: Optional[str]) -> Optional[str]:
+    """Truncate a CSV export to before its last session's rows; return the new last line.
+
+    CSV has a row per character, so an interrupted export can end partway
+    through a session, and resuming after its last row would skip the rest.
+    """
+    if last_line is None or _is_csv_header(last_line):
+        return last_line
+    _, session_id = export.watermark_from_line(last_line, "csv")
+    line = last_line
+    while line is not None and not _is_csv_header(line) and export.watermark_from_line(line, "csv")[1] == session_id:
+        _last_complete_line(path, remove=True)
+        line = _last_complete_line(path)
+    return line
+
+
+async def _run_export(output, export_format, since, after_session_id, batch_size, include_header):
+    # A plain read-only client: the session store would manage indexes (and
+    # their TTLs) with this shell's settings and start a write-behind cache
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], **mongo_client_options())
+    try:
+        db = client[os.environ['DB_NAME']]
+        sessions = read_sessions(
+            db.game_states, db.game_events, export.to_naive_utc(since), after_session_id, batch_size
+        )
+        async for chunk in export.stream_export(sessions, export_format, include_header=include_header):
+            output.write(chunk)
+            output.flush()
+    finally:
+        client.close()
+
+
+@app.command("export")
+def export_sessions(
+    output: Optional[Path] = typer.Option(None, "--output", "-o", help="File to write; stdout if omitted."),
+    export_format: str = typer.Option("ndjson", "--format", "-f", help="ndjson or csv."),
+    since: Optional[datetime] = typer.Option(None, help="Only sessions created after this time (UTC)."),
+    after_session_id: Optional[str] = typer.Option(None, help="Tie-breaker for sessions created exactly at --since."),
+    batch_size: int = typer.Option(500, help="Cursor batch size."),
+    resume: bool = typer.Option(False, help="Append to --output, continuing after its last line."),
+):
+    """Stream game sessions from MongoDB."""
+    if export_format not in export.FORMATS:
+        raise typer.BadParameter(f"must be one of {', '.join(export.FORMATS)}", param_hint="--format")
+
+    include_header = True
+    if resume:
+        if output is None:
+            raise typer.BadParameter("--resume needs --output", param_hint="--resume")
+        last_line = _last_complete_line(output) if output.exists() else None
+        if export_format == "csv":
+            last_line = _rewind_csv_session(output, last_line)
+        if last_line and not (export_format == "csv" and _is_csv_header(last_line)):
+            since, after_session_id = export.watermark_from_line(last_line, export_format)
+            typer.echo(f"Resuming after {since.isoformat()} / {after_session_id}", err=True)
+        include_header = last_line is None
+
+    if output is None:
+        asyncio.run(_run_export(sys.stdout.buffer, export_format, since, after_session_id, batch_size, True))
+        return
+    with open(output, "ab" if resume else "wb") as f:
+        asyncio.run(_run_export(f, export_format, since, after_session_id, batch_size, include_header))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,192 @@
+"""HTTP response compression with gzip and brotli.
+
+``CompressionMiddleware`` compresses JSON and text responses of at least
+``minimum_size`` bytes in the coding the client prefers, favouring brotli
+when both are acceptable. Streaming responses such as the admin export are
+compressed chunk by chunk. Responses that already carry a
+``Content-Encoding`` pass through untouched; that is how the pre-encoded
+catalog responses in ``response_cache`` serve their variants, which are
+compressed once per catalog version at the highest levels. The bootstrap
+response, whose catalog part is fixed but whose session is new each time,
+is gzip only and continues a stream compressed up to the catalog part
+(``GzipPrefix``).
+
+Brotli needs the optional ``brotli`` package; without it only gzip is
+offered.
+"""
+import gzip
+import zlib
+from typing import Container, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Server preference order
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+DEFAULT_MINIMUM_SIZE = 1024
+# Fast levels for per-request compression; precompressed bodies use the maximum
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def negotiate(accept_encoding: Optional[str], available: Container[str] = ENCODINGS) -> Optional[str]:
+    """The preferred coding that the client accepts and is available, or None for identity."""
+    if not accept_encoding:
+        return None
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY if level is None else level)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(body, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+
+def precompress(body: bytes, minimum_size: int = DEFAULT_MINIMUM_SIZE) -> Dict[str, bytes]:
+    """Every available coding of ``body`` at maximum compression, keeping those that are smaller."""
+    if len(body) < minimum_size:
+        return {}
+    variants = {}
+    for encoding in ENCODINGS:
+        compressed = compress(body, encoding, level=11 if encoding == "br" else 9)
+        if len(compressed) < len(body):
+            variants[encoding] = compressed
+    return variants
+
+
+class GzipPrefix:
+    """A gzip stream compressed once up to a fixed prefix and completed per response.
+
+    The compressor's state after the prefix is kept; each body copies it and
+    compresses only its own suffix, so the result is one ordinary gzip
+    member and the suffix can still refer back to the prefix.
+    """
+
+    def __init__(self, prefix: bytes, level: int = 9):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        # A sync flush ends the prefix's output on a byte boundary
+        self.head = self._compressor.compress(prefix) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def complete(self, suffix: bytes) -> bytes:
+        compressor = self._compressor.copy()
+        return self.head + compressor.compress(suffix) + compressor.flush(zlib.Z_FINISH)
+
+
+def add_vary(headers: MutableHeaders):
+    vary = headers.get("vary", "")
+    if "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+
+def is_compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return content_type.startswith("text/") or "json" in content_type
+
+
+class StreamCompressor:
+    """Incremental compression; every chunk is flushed so streamed data reaches the client."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = DEFAULT_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        start_message: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether to compress
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            if compressor is not None:
+                data = compressor.compress(message.get("body", b""))
+                if not message.get("more_body", False):
+                    data += compressor.finish()
+                await send({**message, "body": data})
+                return
+
+            headers = MutableHeaders(scope=start_message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if "content-encoding" in headers or not is_compressible(headers) or start_message["status"] in (204, 304):
+                passthrough = True
+            else:
+                add_vary(headers)
+                if encoding is None or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+
+            if passthrough:
+                await send(start_message)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = encoding
+            if more_body:
+                del headers["content-length"]
+                compressor = StreamCompressor(encoding)
+                await send(start_message)
+                await send({**message, "body": compressor.compress(body)})
+                return
+            body = compress(body, encoding)
+            headers["Content-Length"] = str(len(body))
+            await send(start_message)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
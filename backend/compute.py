@@ -0,0 +1,167 @@
+"""Process pool for CPU-heavy computations.
+
+The Monte Carlo simulator, the plan optimizer and projection job chunks
+hold the CPU for tens to hundreds of milliseconds. Running them on the event loop would stall every
+other request in the worker, so ``ComputePool`` runs them in a pool of
+``COMPUTE_WORKERS`` processes instead.
+
+Each pool process holds a copy of the catalog, handed over once when the
+process starts, so a task only carries ids and NumPy parameter arrays.
+A catalog change replaces the pool. Tasks already submitted finish in the
+old pool against the catalog they were validated against.
+
+With ``COMPUTE_WORKERS=0`` tasks run in a thread instead, which still keeps
+the event loop free while NumPy releases the GIL.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+import optimizer
+import simulation
+from catalog import Catalog
+from metrics import COMPUTE_QUEUE_DEPTH, COMPUTE_TASK_SECONDS, COMPUTE_WAIT_SECONDS
+from models import InsuranceOption, Scenario
+
+# The catalog of the pool process this module runs in
+_worker_catalog: Optional[Catalog] = None
+
+
+def _init_worker(worker_catalog: Catalog):
+    global _worker_catalog
+    _worker_catalog = worker_catalog
+
+
+def _ready() -> bool:
+    return _worker_catalog is not None
+
+
+def _run_task(func: Callable, args: tuple):
+    start = time.perf_counter()
+    result = func(_worker_catalog, *args)
+    return result, time.perf_counter() - start
+
+
+class ComputePool:
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._catalog: Optional[Catalog] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warm_task: Optional[asyncio.Task] = None
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn, not fork: the server process runs an event loop and driver threads
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._catalog,),
+        )
+
+    async def warm(self):
+        """Start every pool process and load its catalog before traffic needs it."""
+        if self._executor is None:
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _ready) for _ in range(self.max_workers)
+        ))
+
+    async def start(self):
+        if self.max_workers > 0:
+            self._executor = self._new_executor()
+            await self.warm()
+
+    def set_catalog(self, new_catalog: Catalog):
+        self._catalog = new_catalog
+        if self._executor is None:
+            return
+        old_executor, self._executor = self._executor, self._new_executor()
+        # Queued tasks still complete in the old pool
+        old_executor.shutdown(wait=False)
+        self._warm_task = asyncio.get_running_loop().create_task(self.warm())
+
+    async def run(self, task_name: str, func: Callable, *args):
+        """Run ``func(catalog, *args)`` off the event loop; ``func`` must be module-level."""
+        COMPUTE_QUEUE_DEPTH.inc()
+        start = time.perf_counter()
+        try:
+            if self._executor is not None:
+                loop = asyncio.get_running_loop()
+                result, run_seconds = await loop.run_in_executor(self._executor, _run_task, func, args)
+            else:
+                result, run_seconds = await asyncio.to_thread(self._run_inline, func, args)
+        finally:
+            COMPUTE_QUEUE_DEPTH.dec()
+        COMPUTE_TASK_SECONDS.observe(run_seconds, task_name)
+        COMPUTE_WAIT_SECONDS.observe(time.perf_counter() - start - run_seconds, task_name)
+        return result
+
+    def _run_inline(self, func: Callable, args: tuple):
+        start = time.perf_counter()
+        result = func(self._catalog, *args)
+        return result, time.perf_counter() - start
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# Tasks; each runs in a pool process with that process's catalog
+
+def simulate_task(task_catalog: Catalog, character_ids: Optional[List[str]], years: int, seed: int) -> dict:
+    characters = task_catalog.characters
+    if character_ids is not None:
+        characters = [task_catalog.characters_by_id[cid] for cid in character_ids]
+    return simulation.simulate(characters, task_catalog.insurance_options, task_catalog.scenarios, years, seed)
+
+
+def optimize_task(
+    task_catalog: Catalog,
+    scenario_ids: Optional[List[str]],
+    age: int,
+    deductibles,
+    copayment_percentages,
+    coverage_limits,
+    loading: float,
+    risk_loading: float,
+    max_points: int,
+) -> dict:
+    scenarios = task_catalog.scenarios
+    if scenario_ids is not None:
+        scenarios = [task_catalog.scenarios_by_id[sid] for sid in scenario_ids]
+    return optimizer.optimize(
+        scenarios,
+        age,
+        deductibles,
+        copayment_percentages,
+        coverage_limits,
+        loading=loading,
+        risk_loading=risk_loading,
+        reference_plans=task_catalog.insurance_options,
+        max_points=max_points,
+    )
+
+
+def projection_task(
+    task_catalog: Catalog,
+    plans: List[dict],
+    scenarios: List[dict],
+    cohort: List[dict],
+    year_index: int,
+    paths: int,
+    seed: int,
+) -> dict:
+    # Jobs carry the plans and scenarios they were started with, so a
+    # resumed job is unaffected by catalog changes since
+    return simulation.project_year(
+        cohort,
+        [InsuranceOption(**plan) for plan in plans],
+        [Scenario(**scenario) for scenario in scenarios],
+        year_index,
+        paths,
+        seed,
+    )
@@ -0,0 +1,237 @@
+"""Plan-choice analytics over completed decisions.
+
+Decisions are counted server-side into daily buckets keyed by
+(day, character, age band, plan) with a ``$group`` pipeline over
+``game_states.completed_decisions``; only those small bucket rows reach
+Python, where they are rolled up per character, per age band and per day.
+
+``DecisionStats`` keeps the buckets in memory and refreshes them in the
+background every ``ttl_seconds``. A refresh only re-aggregates the days
+that have sessions updated since the previous one, so dashboard polling
+never triggers a full scan. Snapshots stamp ``updated_at`` with the
+database clock, so each incremental query reaches back ``overlap_seconds``
+before the previous refresh to allow for skew with this host's clock. A
+full rebuild runs every ``full_refresh_seconds`` to drop sessions removed
+by the TTL index.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# (lower bound inclusive, upper bound exclusive, label)
+AGE_BANDS = (
+    (0, 25, "under_25"),
+    (25, 35, "25-34"),
+    (35, 50, "35-49"),
+    (50, 65, "50-64"),
+    (65, None, "65+"),
+)
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def age_band(age: Optional[int]) -> str:
+    if age is None:
+        return "unknown"
+    for lower, upper, label in AGE_BANDS:
+        if age >= lower and (upper is None or age < upper):
+            return label
+    return "unknown"
+
+
+def age_band_expression(age: str) -> dict:
+    """``$switch`` mapping an age field to the same labels as ``age_band``.
+
+    Missing and null ages sort below every number, so they fall through to
+    the default.
+    """
+    branches = []
+    for lower, upper, label in AGE_BANDS:
+        conditions = [{"$gte": [age, lower]}]
+        if upper is not None:
+            conditions.append({"$lt": [age, upper]})
+        branches.append({"case": {"$and": conditions}, "then": label})
+    return {"$switch": {"branches": branches, "default": "unknown"}}
+
+
+def day_range_filter(days: Iterable[str]) -> dict:
+    """Filter on ``created_at`` matching any of the given UTC days."""
+    ranges = []
+    for day in sorted(set(days)):
+        start = datetime.strptime(day, DAY_FORMAT)
+        ranges.append({"created_at": {"$gte": start, "$lt": start + timedelta(days=1)}})
+    return {"$or": ranges} if ranges else {"_id": {"$exists": False}}
+
+
+def bucket_pipeline(match: dict) -> List[dict]:
+    """Decision counts per (day, character_id, age_band, insurance_option_id)."""
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}},
+            "characters": 1,
+            "decisions": {"$objectToArray": "$completed_decisions"},
+        }},
+        {"$unwind": "$decisions"},
+        {"$project": {
+            "day": 1,
+            "character_id": "$decisions.k",
+            "insurance_option_id": "$decisions.v",
+            "character": {"$arrayElemAt": [
+                {"$filter": {
+                    "input": "$characters",
+                    "as": "character",
+                    "cond": {"$eq": ["$$character.id", "$decisions.k"]},
+                }},
+                0,
+            ]},
+        }},
+        {"$group": {
+            "_id": {
+                "day": "$day",
+                "character_id": "$character_id",
+                "age_band": age_band_expression("$character.age"),
+                "insurance_option_id": "$insurance_option_id",
+            },
+            "count": {"$sum": 1},
+        }},
+    ]
+
+
+def changed_days_pipeline(updated_since: datetime) -> List[dict]:
+    """Creation days of sessions whose decisions changed since ``updated_since``."""
+    return [
+        {"$match": {"updated_at": {"$gte": updated_since}}},
+        {"$group": {"_id": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}}}},
+    ]
+
+
+def session_buckets(documents: Iterable[dict]) -> List[dict]:
+    """Python equivalent of ``bucket_pipeline`` for stores without aggregation."""
+    counts: Dict[tuple, int] = defaultdict(int)
+    for document in documents:
+        day = document["created_at"].strftime(DAY_FORMAT)
+        ages = {c["id"]: c.get("age") for c in document["characters"]}
+        for character_id, option_id in document["completed_decisions"].items():
+            counts[(day, character_id, age_band(ages.get(character_id)), option_id)] += 1
+    return [
+        {"day": day, "character_id": character_id, "age_band": band, "insurance_option_id": option_id, "count": count}
+        for (day, character_id, band, option_id), count in counts.items()
+    ]
+
+
+def _plan_rates(counts: Dict[str, int]) -> dict:
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "plans": {
+            option_id: {"count": count, "rate": round(count / total, 4)}
+            for option_id, count in sorted(counts.items())
+        },
+    }
+
+
+def summarize(buckets: Iterable[dict]) -> dict:
+    by_character: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    by_age_band: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    by_day: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    total = 0
+    for bucket in buckets:
+        option_id, count = bucket["insurance_option_id"], bucket["count"]
+        by_character[bucket["character_id"]][option_id] += count
+        by_age_band[bucket["age_band"]][option_id] += count
+        by_day[bucket["day"]][option_id] += count
+        total += count
+
+    return {
+        "total_decisions": total,
+        "per_character": {cid: _plan_rates(counts) for cid, counts in sorted(by_character.items())},
+        "per_age_band": {band: _plan_rates(counts) for band, counts in sorted(by_age_band.items())},
+        "over_time": [{"date": day, **_plan_rates(counts)} for day, counts in sorted(by_day.items())],
+    }
+
+
+class DecisionStats:
+    """Background-refreshed decision analytics for one ``SessionStore``."""
+
+    def __init__(
+        self,
+        store,
+        ttl_seconds: float = 30.0,
+        full_refresh_seconds: float = 3600.0,
+        overlap_seconds: float = 5.0,
+    ):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        # day -> bucket rows for that day
+        self._buckets: Dict[str, List[dict]] = {}
+        self._summary: Optional[dict] = None
+        self._refreshed_at: Optional[datetime] = None
+        self._full_refreshed_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self, full: bool = False):
+        async with self._lock:
+            await self._refresh(full)
+
+    async def _refresh(self, full: bool = False):
+        started = datetime.utcnow()
+        if full or self._full_refreshed_at is None or \
+                started - self._full_refreshed_at >= timedelta(seconds=self.full_refresh_seconds):
+            buckets = await self.store.decision_buckets()
+            by_day: Dict[str, List[dict]] = defaultdict(list)
+            for bucket in buckets:
+                by_day[bucket["day"]].append(bucket)
+            self._buckets = dict(by_day)
+            self._full_refreshed_at = started
+        else:
+            since = self._refreshed_at - timedelta(seconds=self.overlap_seconds)
+            days = await self.store.decision_days_changed(since)
+            if days:
+                buckets = await self.store.decision_buckets(days)
+                updated = {day: [] for day in days}
+                for bucket in buckets:
+                    updated[bucket["day"]].append(bucket)
+                self._buckets = {**self._buckets, **updated}
+        self._refreshed_at = started
+        self._summary = {
+            "generated_at": started,
+            **summarize(bucket for rows in self._buckets.values() for bucket in rows),
+        }
+
+    async def get(self) -> dict:
+        if self._summary is None:
+            async with self._lock:
+                # The first background refresh may have finished while we waited
+                if self._summary is None:
+                    await self._refresh()
+        return self._summary
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Decision stats refresh failed")
+            await asyncio.sleep(self.ttl_seconds)
+
+    def start(self):
+        """Refresh in the background now and every ``ttl_seconds`` after."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
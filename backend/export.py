@@ -0,0 +1,89 @@
+"""Streaming export of game sessions for analytics.
+
+Sessions come from ``SessionStore.iter_sessions`` in (created_at, session_id)
+order and are written either as NDJSON (one session per line) or CSV (one
+row per character, so plan choices line up with character profiles).
+
+Every line carries ``created_at`` and ``session_id``; pass the values from
+the last line received as ``since`` / ``after_session_id`` to resume.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+
+import fast_json
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CSV_COLUMNS = [
+    "session_id", "created_at", "current_chapter",
+    "character_id", "character_name", "age", "occupation",
+    "current_health_status", "lifestyle", "insurance_choice",
+]
+# Lines buffered before a chunk is handed to the response
+CHUNK_LINES = 100
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; convert aware watermarks to match."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def csv_rows(document: dict) -> List[list]:
+    created_at = document["created_at"].isoformat()
+    return [
+        [
+            document["session_id"], created_at, document["current_chapter"],
+            character["id"], character["name"], character["age"], character["occupation"],
+            character["current_health_status"], character["lifestyle"], character.get("insurance_choice") or "",
+        ]
+        for character in document["characters"]
+    ]
+
+
+def _encode_csv(rows: List[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_export(
+    sessions: AsyncIterator[dict],
+    export_format: str,
+    include_header: bool = True,
+) -> AsyncIterator[bytes]:
+    """Encode sessions as NDJSON or CSV, yielding a chunk every ``CHUNK_LINES`` lines."""
+    if export_format == "csv" and include_header:
+        yield _encode_csv([CSV_COLUMNS])
+
+    pending: list = []
+    async for document in sessions:
+        if export_format == "csv":
+            pending.extend(csv_rows(document))
+        else:
+            pending.append(document)
+        if len(pending) >= CHUNK_LINES:
+            yield _encode_chunk(pending, export_format)
+            pending = []
+    if pending:
+        yield _encode_chunk(pending, export_format)
+
+
+def _encode_chunk(items: list, export_format: str) -> bytes:
+    if export_format == "csv":
+        return _encode_csv(items)
+    return b"".join(fast_json.dumps(document) + b"\n" for document in items)
+
+
+def watermark_from_line(line: str, export_format: str) -> Tuple[datetime, str]:
+    """(created_at, session_id) of an exported line, used to resume an export."""
+    if export_format == "csv":
+        session_id, created_at = next(csv.reader([line]))[:2]
+    else:
+        document = json.loads(line)
+        session_id, created_at = document["session_id"], document["created_at"]
+    return datetime.fromisoformat(created_at), session_id
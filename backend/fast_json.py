@@ -0,0 +1,50 @@
+"""JSON encoding for responses, using orjson when it is installed.
+
+``FastJSONResponse`` is the app's default response class. Handlers that
+already have plain dicts/lists return it directly to skip FastAPI's
+``jsonable_encoder`` pass, and Pydantic models go through
+``model_dump_json`` via ``model_response``.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def _default(value: Any):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def dumps(content: Any) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+            default=_default,
+        ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, or the stdlib encoder as a fallback."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def model_response(model: BaseModel, status_code: int = 200) -> Response:
+    """Serialize a Pydantic model straight to JSON bytes."""
+    return Response(model.model_dump_json(), status_code=status_code, media_type="application/json")
@@ -0,0 +1,114 @@
+"""Decision events, the append-only history of game sessions.
+
+Every decision is stored as an immutable event in the ``game_events``
+collection::
+
+    {"_id": "<session_id>:<seq>", "session_id": ..., "seq": 3, "type": "decision",
+     "character_id": ..., "insurance_option_id": ..., "created_at": ...}
+
+``seq`` numbers a session's events from 1. The ``game_states`` document is
+a snapshot of the session after its first ``snapshot_seq`` events, so the
+current state is the snapshot with the later events applied in ``seq``
+order. Event ids are derived from (session_id, seq), which makes writing
+an event again after a failed or retried insert harmless.
+
+Sequence numbers are assigned by the process holding the session. If
+another process has written a different event under the same id, the
+session cache treats it as a conflict: it reloads the session and
+re-applies its own decisions after the stored ones.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+DECISION = "decision"
+
+
+def snapshot_seq(document: dict) -> int:
+    """Number of events folded into the stored snapshot."""
+    return document.get("snapshot_seq", 0)
+
+
+def event_seq(document: dict) -> int:
+    """Number of events applied to this copy of the session."""
+    return document.get("event_seq", snapshot_seq(document))
+
+
+def decision_event(session_id: str, seq: int, character_id: str, insurance_option_id: str) -> dict:
+    return {
+        "_id": f"{session_id}:{seq}",
+        "session_id": session_id,
+        "seq": seq,
+        "type": DECISION,
+        "character_id": character_id,
+        "insurance_option_id": insurance_option_id,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def same_event(event: dict, other: Optional[dict]) -> bool:
+    """Whether ``other`` records the same decision, e.g. an event written by an earlier attempt."""
+    return other is not None and all(
+        event[key] == other.get(key) for key in ("session_id", "seq", "type", "character_id", "insurance_option_id")
+    )
+
+
+def apply_decision(document: dict, character_id: str, insurance_option_id: str) -> bool:
+    """Set a character's plan in a session document; False if the character is not in it."""
+    character = next((c for c in document["characters"] if c["id"] == character_id), None)
+    if not character:
+        return False
+    character["insurance_choice"] = insurance_option_id
+    document["completed_decisions"][character_id] = insurance_option_id
+    return True
+
+
+def replay(document: dict, events: Iterable[dict]) -> dict:
+    """Apply the events newer than the document's snapshot, in order."""
+    seq = event_seq(document)
+    for event in sorted(events, key=lambda e: e["seq"]):
+        if event["seq"] <= seq:
+            continue
+        if event["type"] == DECISION:
+            apply_decision(document, event["character_id"], event["insurance_option_id"])
+        seq = event["seq"]
+    document["event_seq"] = seq
+    return document
+
+
+def events_after_filter(documents: Iterable[dict]) -> dict:
+    """Mongo filter for the events each snapshot does not include yet."""
+    return {"$or": [
+        {"session_id": document["session_id"], "seq": {"$gt": snapshot_seq(document)}}
+        for document in documents
+    ]}
+
+
+def group_by_session(events: Iterable[dict]) -> Dict[str, List[dict]]:
+    grouped: Dict[str, List[dict]] = {}
+    for event in events:
+        grouped.setdefault(event["session_id"], []).append(event)
+    return grouped
+
+
+def snapshot_update(document: dict) -> UpdateOne:
+    """Write the session's current state as its snapshot, unless a newer one is stored.
+
+    ``updated_at`` is set by the server when the write is applied, so a
+    reader querying ``updated_at >= t`` cannot miss a write that becomes
+    visible after it ran.
+    """
+    seq = event_seq(document)
+    return UpdateOne(
+        {"session_id": document["session_id"], "snapshot_seq": {"$not": {"$gte": seq}}},
+        {
+            "$set": {
+                # Copies: the driver encodes the update after the event loop moves on
+                "characters": [dict(c) for c in document["characters"]],
+                "completed_decisions": dict(document["completed_decisions"]),
+                "snapshot_seq": seq,
+            },
+            "$currentDate": {"updated_at": True},
+        },
+    )
@@ -0,0 +1,471 @@
+"""Background jobs for long cohort cost projections.
+
+A projection job covers one simulated year per chunk. After each chunk the
+year's results are stored as a document of their own (the results of a
+long job for a large cohort would not fit in the job document) and the
+job's progress counter advances, so a job interrupted by a restart
+resumes at the first missing year. Years are seeded by (seed, year),
+which makes a recomputed year identical to the lost one.
+
+Jobs are claimed with a lease, which the worker running a job renews from
+a heartbeat however long a chunk takes. If the worker dies, any worker
+may claim the job once the lease expires, and saves are conditional on
+holding the lease, so two workers never advance the same job.
+Cancellation sets a flag that the runner checks between chunks.
+
+Job views carry progress and the cohort totals summed so far; per-member
+results are read a page of years at a time.
+
+``JOB_STORE`` selects where jobs live: "mongo" (the ``projection_jobs``
+and ``projection_results`` collections) or "memory". It defaults to
+``SESSION_STORE``, and with both in Mongo the jobs use the session
+store's client.
+"""
+import asyncio
+import copy
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+import compute
+from metrics import InstrumentedCollection
+from session_store import DEFAULT_SESSION_TTL_SECONDS, MotorSessionStore, SessionStore, mongo_client_options
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+def new_job(params: dict, inputs: dict, total_chunks: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "_id": uuid.uuid4().hex,
+        "type": "projection",
+        "status": QUEUED,
+        "created_at": now,
+        "updated_at": now,
+        "params": params,
+        "inputs": inputs,
+        "progress": {"completed": 0, "total": total_chunks},
+        "error": None,
+        "cancel_requested": False,
+        "owner": None,
+        "lease_expires_at": None,
+    }
+
+
+def job_view(job: dict, cohort_totals: Sequence[dict] = (), results: Optional[Sequence[dict]] = None) -> dict:
+    """API representation of a job, with cohort totals summed over the finished years.
+
+    Per-member ``results`` are only included when given, with the year to
+    ask for next if more are saved.
+    """
+    summary: Dict[str, dict] = {}
+    for cohort in cohort_totals:
+        for plan_id, totals in cohort.items():
+            plan_summary = summary.setdefault(plan_id, dict.fromkeys(totals, 0.0))
+            for key, value in totals.items():
+                plan_summary[key] += value
+    progress = job["progress"]
+    view = {
+        "job_id": job["_id"],
+        "type": job["type"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "cancel_requested": job["cancel_requested"],
+        "progress": {**progress, "fraction": progress["completed"] / progress["total"]},
+        "params": job["params"],
+        "summary": summary,
+        "error": job["error"],
+    }
+    if results is not None:
+        view["results"] = list(results)
+        next_year = results[-1]["year"] + 1 if results else None
+        view["next_from_year"] = next_year if next_year is not None and next_year <= progress["completed"] else None
+    return view
+
+
+class JobStore(ABC):
+    async def start(self):
+        """Prepare the store before serving requests."""
+
+    async def close(self):
+        """Release resources."""
+
+    @abstractmethod
+    async def create(self, job: dict) -> dict:
+        ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def claim(self, owner: str, lease_seconds: float) -> Optional[dict]:
+        """Lease the oldest active job whose lease is free or expired."""
+
+    @abstractmethod
+    async def results(self, job_id: str, start: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """Up to ``limit`` saved chunk results from chunk ``start``, in chunk order."""
+
+    @abstractmethod
+    async def cohort_totals(self, job_id: str) -> List[dict]:
+        """Each saved chunk's cohort totals, in chunk order, without the per-member results."""
+
+    @abstractmethod
+    async def save_chunk(self, job_id: str, owner: str, index: int, result: dict, lease_seconds: float) -> Optional[dict]:
+        """Store chunk ``index``, advance the job's progress and renew the lease.
+
+        Returns None if ``owner`` no longer holds the job or the chunk was
+        already saved.
+        """
+
+    @abstractmethod
+    async def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend the lease; False if ``owner`` no longer holds the job."""
+
+    @abstractmethod
+    async def finish(self, job_id: str, owner: str, status: str, error: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    async def release(self, job_id: str, owner: str):
+        """Give up the lease so another worker can resume the job right away."""
+
+    @abstractmethod
+    async def request_cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a queued job, or flag a running one; returns the job."""
+
+
+class MotorJobStore(JobStore):
+    """Jobs in MongoDB.
+
+    With ``session_store`` the jobs live in its database and share its
+    connection pool, so it must be started first; otherwise the store
+    opens a client of its own.
+    """
+
+    def __init__(
+        self,
+        mongo_url: str,
+        db_name: str,
+        ttl_seconds: int,
+        client_options: Optional[dict] = None,
+        session_store: Optional[MotorSessionStore] = None,
+    ):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.ttl_seconds = ttl_seconds
+        self.client_options = client_options or {}
+        self.session_store = session_store
+        self.client = None
+        self.jobs = None
+        self.chunk_results = None
+
+    async def start(self):
+        if self.jobs is None:
+            if self.session_store is not None:
+                db = self.session_store.db
+            else:
+                self.client = AsyncIOMotorClient(self.mongo_url, **self.client_options)
+                db = self.client[self.db_name]
+            self.jobs = InstrumentedCollection(db.projection_jobs)
+            self.chunk_results = InstrumentedCollection(db.projection_results)
+        await self.jobs.create_index([("status", 1), ("created_at", 1)], name="status_created_at")
+        await self.jobs.create_index("created_at", expireAfterSeconds=self.ttl_seconds, name="created_at_ttl")
+        await self.chunk_results.create_index([("job_id", 1), ("index", 1)], name="job_index")
+        await self.chunk_results.create_index(
+            "created_at", expireAfterSeconds=self.ttl_seconds, name="created_at_ttl"
+        )
+
+    async def close(self):
+        # A shared client is closed by the session store
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def create(self, job):
+        await self.jobs.insert_one(job)
+        return job
+
+    async def get(self, job_id):
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def claim(self, owner, lease_seconds):
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {
+                "status": {"$in": list(ACTIVE_STATUSES)},
+                "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now}}],
+            },
+            {"$set": {
+                "status": RUNNING,
+                "owner": owner,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            }},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def results(self, job_id, start=0, limit=None):
+        cursor = self.chunk_results.find({"job_id": job_id, "index": {"$gte": start}}).sort("index", 1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [document["result"] async for document in cursor]
+
+    async def cohort_totals(self, job_id):
+        # Member results are most of each chunk's size; progress polls skip them
+        cursor = self.chunk_results.find({"job_id": job_id}, {"_id": 0, "result.cohort": 1}).sort("index", 1)
+        return [document["result"]["cohort"] async for document in cursor]
+
+    async def save_chunk(self, job_id, owner, index, result, lease_seconds):
+        now = datetime.utcnow()
+        # Written before the lease check; chunks are deterministic, so a
+        # worker that lost the lease rewrites the same result
+        await self.chunk_results.replace_one(
+            {"_id": f"{job_id}:{index}"},
+            {"job_id": job_id, "index": index, "created_at": now, "result": result},
+            upsert=True,
+        )
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, "owner": owner, "status": RUNNING, "progress.completed": index},
+            {"$set": {
+                "progress.completed": index + 1,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now,
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job_id, owner, lease_seconds):
+        now = datetime.utcnow()
+        result = await self.jobs.update_one(
+            {"_id": job_id, "owner": owner, "status": RUNNING},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}},
+        )
+        return result.matched_count == 1
+
+    async def finish(self, job_id, owner, status, error=None):
+        await self.jobs.update_one(
+            {"_id": job_id, "owner": owner},
+            {"$set": {"status": status, "error": error, "lease_expires_at": None, "updated_at": datetime.utcnow()}},
+        )
+
+    async def release(self, job_id, owner):
+        await self.jobs.update_one(
+            {"_id": job_id, "owner": owner, "status": RUNNING},
+            {"$set": {"lease_expires_at": None, "updated_at": datetime.utcnow()}},
+        )
+
+    async def request_cancel(self, job_id):
+        now = datetime.utcnow()
+        job = await self.jobs.find_one_and_update(
+            {"_id": job_id, "status": QUEUED},
+            {"$set": {"status": CANCELLED, "cancel_requested": True, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            return job
+        job = await self.jobs.find_one_and_update(
+            {"_id": job_id, "status": RUNNING},
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        # Finished jobs are returned unchanged
+        return job if job is not None else await self.get(job_id)
+
+
+class MemoryJobStore(JobStore):
+    """Process-local jobs; they do not survive a restart."""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._results: Dict[str, Dict[int, dict]] = {}
+
+    async def create(self, job):
+        self._jobs[job["_id"]] = copy.deepcopy(job)
+        return job
+
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return copy.deepcopy(job) if job else None
+
+    async def claim(self, owner, lease_seconds):
+        now = datetime.utcnow()
+        for job in sorted(self._jobs.values(), key=lambda j: j["created_at"]):
+            if job["status"] not in ACTIVE_STATUSES:
+                continue
+            if job["lease_expires_at"] is not None and job["lease_expires_at"] >= now:
+                continue
+            job.update(status=RUNNING, owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+            return copy.deepcopy(job)
+        return None
+
+    async def results(self, job_id, start=0, limit=None):
+        chunks = self._results.get(job_id, {})
+        indexes = [index for index in sorted(chunks) if index >= start][:limit]
+        return [copy.deepcopy(chunks[index]) for index in indexes]
+
+    async def cohort_totals(self, job_id):
+        chunks = self._results.get(job_id, {})
+        return [copy.deepcopy(chunks[index]["cohort"]) for index in sorted(chunks)]
+
+    async def save_chunk(self, job_id, owner, index, result, lease_seconds):
+        job = self._jobs.get(job_id)
+        if not job or job["owner"] != owner or job["status"] != RUNNING or job["progress"]["completed"] != index:
+            return None
+        now = datetime.utcnow()
+        self._results.setdefault(job_id, {})[index] = result
+        job["progress"]["completed"] = index + 1
+        job.update(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        return copy.deepcopy(job)
+
+    async def renew(self, job_id, owner, lease_seconds):
+        job = self._jobs.get(job_id)
+        if not job or job["owner"] != owner or job["status"] != RUNNING:
+            return False
+        now = datetime.utcnow()
+        job.update(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        return True
+
+    async def finish(self, job_id, owner, status, error=None):
+        job = self._jobs.get(job_id)
+        if job and job["owner"] == owner:
+            job.update(status=status, error=error, lease_expires_at=None, updated_at=datetime.utcnow())
+
+    async def release(self, job_id, owner):
+        job = self._jobs.get(job_id)
+        if job and job["owner"] == owner and job["status"] == RUNNING:
+            job.update(lease_expires_at=None, updated_at=datetime.utcnow())
+
+    async def request_cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if not job:
+            return None
+        if job["status"] in ACTIVE_STATUSES:
+            job.update(cancel_requested=True, updated_at=datetime.utcnow())
+            if job["status"] == QUEUED:
+                job["status"] = CANCELLED
+        return copy.deepcopy(job)
+
+
+def create_job_store(environ=os.environ, session_store: Optional[SessionStore] = None) -> JobStore:
+    """Build the store selected by ``JOB_STORE``, sharing a Mongo session store's client."""
+    backend = environ.get('JOB_STORE', environ.get('SESSION_STORE', 'mongo')).lower()
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'mongo':
+        return MotorJobStore(
+            environ['MONGO_URL'],
+            environ['DB_NAME'],
+            ttl_seconds=int(environ.get('JOB_TTL_SECONDS', str(DEFAULT_SESSION_TTL_SECONDS))),
+            client_options=mongo_client_options(environ),
+            session_store=session_store if isinstance(session_store, MotorSessionStore) else None,
+        )
+    raise ValueError(f"Unknown JOB_STORE {backend!r}; expected 'mongo' or 'memory'")
+
+
+class ProjectionRunner:
+    """Claims projection jobs and runs them chunk by chunk on the compute pool."""
+
+    def __init__(self, store: JobStore, compute_pool, lease_seconds: float = 120.0, poll_interval: float = 5.0):
+        self.store = store
+        self.compute_pool = compute_pool
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = uuid.uuid4().hex
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Look for work now instead of at the next poll."""
+        self._wake.set()
+
+    async def _heartbeat(self, job_id: str):
+        """Renew the lease while a job runs, so a slow chunk does not let another worker take it."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self.store.renew(job_id, self.owner, self.lease_seconds):
+                    logger.warning(f"Lost the lease on job {job_id} while running a chunk")
+                    return
+            except Exception:
+                logger.exception(f"Could not renew the lease on job {job_id}")
+
+    async def _execute(self, job: dict):
+        job_id = job["_id"]
+        params, inputs = job["params"], job["inputs"]
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            for index in range(job["progress"]["completed"], job["progress"]["total"]):
+                if job["cancel_requested"]:
+                    await self.store.finish(job_id, self.owner, CANCELLED)
+                    return
+                result = await self.compute_pool.run(
+                    "projection",
+                    compute.projection_task,
+                    inputs["insurance_options"],
+                    inputs["scenarios"],
+                    params["cohort"],
+                    index,
+                    params["paths"],
+                    params["seed"],
+                )
+                job = await self.store.save_chunk(job_id, self.owner, index, result, self.lease_seconds)
+                if job is None:
+                    logger.warning(f"Lost the lease on job {job_id}; leaving it to its new owner")
+                    return
+            await self.store.finish(job_id, self.owner, CANCELLED if job["cancel_requested"] else COMPLETED)
+        except asyncio.CancelledError:
+            # Shutting down; let the next worker resume from the last saved chunk
+            await asyncio.shield(self.store.release(job_id, self.owner))
+            raise
+        except Exception as e:
+            logger.exception(f"Projection job {job_id} failed")
+            await self.store.finish(job_id, self.owner, FAILED, error=str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                job = await self.store.claim(self.owner, self.lease_seconds)
+            except Exception:
+                logger.exception("Could not claim projection jobs")
+                job = None
+            if job is not None:
+                await self._execute(job)
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        await self.store.start()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.store.close()
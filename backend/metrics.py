@@ -0,0 +1,271 @@
+"""Minimal Prometheus-style metrics.
+
+Counters, gauges and histograms keyed by label values, rendered in the
+Prometheus text exposition format on ``/metrics``. Updates are plain dict
+and list operations, cheap enough to run on every request.
+"""
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import profiling
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (non-cumulative, +Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by method, route and status code.", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route.", ("method", "route")))
+HTTP_IN_PROGRESS = REGISTRY.register(Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served.", ("method",)))
+HTTP_ERRORS = REGISTRY.register(Counter(
+    "http_request_errors_total", "HTTP requests that raised or returned a 5xx status.", ("method", "route")))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    "mongo_operation_duration_seconds", "MongoDB call latency by collection and operation.",
+    ("collection", "operation")))
+COMPUTE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "compute_tasks_in_progress", "Compute tasks submitted to the pool and not yet finished."))
+COMPUTE_TASK_SECONDS = REGISTRY.register(Histogram(
+    "compute_task_duration_seconds", "Time compute tasks spend running, by task.", ("task",)))
+COMPUTE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "compute_task_wait_seconds", "Time compute tasks spend queued or in transfer, by task.", ("task",)))
+SESSION_READS_COALESCED = REGISTRY.register(Counter(
+    "session_reads_coalesced_total", "Session reads that joined an in-flight lookup instead of querying MongoDB."))
+SESSION_WRITE_CONFLICTS = REGISTRY.register(Counter(
+    "session_write_conflicts_total", "Sessions reloaded because another process wrote events with the same numbers."))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route counts, latency and in-flight requests.
+
+    Routes are labelled with their path template (``/api/game/{session_id}``)
+    so label cardinality stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_PROGRESS.dec(method)
+            route = scope.get("route")
+            route_label = route.path if route is not None else "unmatched"
+            HTTP_REQUESTS.inc(method, route_label, str(status_code))
+            HTTP_LATENCY.observe(elapsed, method, route_label)
+            if status_code >= 500:
+                HTTP_ERRORS.inc(method, route_label)
+
+
+# Collection methods whose latency is recorded
+TIMED_OPERATIONS = frozenset({
+    "find_one", "find_one_and_update", "insert_one", "insert_many",
+    "update_one", "update_many", "delete_one", "bulk_write", "replace_one",
+    "count_documents", "create_index", "index_information",
+})
+# Collection methods returning a cursor; the time spent fetching its results is recorded
+CURSOR_OPERATIONS = frozenset({"find", "aggregate"})
+
+
+def _record_db_time(elapsed: float, collection: str, operation: str):
+    MONGO_LATENCY.observe(elapsed, collection, operation)
+    profiling.add_db_time(elapsed)
+
+
+class InstrumentedCursor:
+    """Proxy for a Motor cursor that times fetching its results.
+
+    Chained calls such as ``sort`` return the proxy. A full iteration is
+    recorded as one observation, like ``to_list``.
+    """
+
+    def __init__(self, cursor, collection: str, operation: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+        self._iterator = None
+        self._elapsed = 0.0
+
+    def __getattr__(self, attr):
+        target = getattr(self._cursor, attr)
+        if not callable(target):
+            return target
+
+        def chained(*args, **kwargs):
+            result = target(*args, **kwargs)
+            return self if result is self._cursor else result
+
+        return chained
+
+    async def to_list(self, length=None):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            _record_db_time(time.perf_counter() - start, self._collection, self._operation)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = self._cursor.__aiter__()
+        start = time.perf_counter()
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            MONGO_LATENCY.observe(self._elapsed + time.perf_counter() - start, self._collection, self._operation)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._elapsed += elapsed
+            profiling.add_db_time(elapsed)
+
+
+class InstrumentedCollection:
+    """Proxy for a Motor collection that times its operations, including cursor reads."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, attr):
+        target = getattr(self._collection, attr)
+        if attr in CURSOR_OPERATIONS:
+            return lambda *args, **kwargs: InstrumentedCursor(target(*args, **kwargs), self._name, attr)
+        if attr not in TIMED_OPERATIONS:
+            return target
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await target(*args, **kwargs)
+            finally:
+                _record_db_time(time.perf_counter() - start, self._name, attr)
+
+        return timed
@@ -0,0 +1,37 @@
+"""Catalog models shared by the API and the catalog loader."""
+import uuid
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class Character(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    age: int
+    occupation: str
+    current_health_status: str
+    lifestyle: str
+    insurance_choice: Optional[str] = None
+
+
+class InsuranceOption(BaseModel):
+    id: str
+    name: str
+    type: str  # "basic" or "enhanced"
+    monthly_premium: float
+    annual_deductible: float
+    copayment_percentage: float
+    coverage_limit: float
+    key_benefits: List[str]
+
+
+class Scenario(BaseModel):
+    id: str
+    title: str
+    description: str
+    medical_situation: str
+    treatment_cost: float
+    urgency_level: str  # "low", "medium", "high"
+    category: str  # "emergency", "routine", "preventive", "specialist"
+    age_relevance: str  # "high", "medium", "low"
@@ -0,0 +1,160 @@
+"""Plan-design search over deductible, copayment and coverage limit grids.
+
+Every combination of the three parameter grids is scored against the
+scenario mix with broadcast NumPy passes over
+(deductibles, copayments, limits, scenarios) arrays. Scenarios are taken
+in blocks, so memory stays bounded however many the catalog has.
+Scenario weights are the annual event probabilities from
+``simulation.event_probabilities`` for the character's age.
+
+A candidate's premium is priced from the same mix with the standard
+deviation principle: the expected amount the insurer pays per year, plus a
+``loading`` fraction of it for costs and margin, plus ``risk_loading``
+times the standard deviation of that payout, with each scenario occurring
+independently at most once a year. Without the risk charge, premium plus
+expected out-of-pocket cost would be the same for every candidate and all
+of them would lie on one line. With it, designs that leave the insurer the
+volatile tail cost more than their expected claims.
+
+The result is the Pareto front of annual premium against expected annual
+out-of-pocket cost, meaning the candidates for which no other candidate is
+cheaper on both.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+import outcome_engine
+import simulation
+
+DEFAULT_LOADING = 0.25
+DEFAULT_RISK_LOADING = 0.1
+# Upper bound on grid size, which bounds the result arrays
+MAX_CANDIDATES = 200_000
+# Cells per (candidates x scenarios) block; each float64 temporary is 16 MB
+BLOCK_CELLS = 2_000_000
+
+
+def score_grid(
+    deductibles: np.ndarray,
+    copayment_percentages: np.ndarray,
+    coverage_limits: np.ndarray,
+    treatment_costs: np.ndarray,
+    probabilities: np.ndarray,
+    loading: float = DEFAULT_LOADING,
+    risk_loading: float = DEFAULT_RISK_LOADING,
+) -> Dict[str, np.ndarray]:
+    """Parameters, premium and expected out-of-pocket cost for every grid point, flattened."""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    # Variance of an independent yearly event of probability p
+    event_variances = probabilities * (1 - probabilities)
+    cost = np.asarray(treatment_costs, dtype=np.float64)
+    deductible = np.asarray(deductibles, dtype=np.float64)[:, None, None, None]
+    copay_rate = np.asarray(copayment_percentages, dtype=np.float64)[None, :, None, None] / 100
+    limit = np.asarray(coverage_limits, dtype=np.float64)[None, None, :, None]
+
+    # Means and variances are sums over scenarios, so they accumulate block by block
+    shape = (deductible.shape[0], copay_rate.shape[1], limit.shape[2])
+    expected_out_of_pocket = np.zeros(shape)
+    expected_covered = np.zeros(shape)
+    covered_variance = np.zeros(shape)
+    block = max(1, BLOCK_CELLS // (shape[0] * shape[1] * shape[2]))
+    for start in range(0, cost.size, block):
+        scenarios = slice(start, start + block)
+        out_of_pocket = outcome_engine.total_out_of_pocket(cost[scenarios], deductible, copay_rate, limit)
+        expected_out_of_pocket += out_of_pocket @ probabilities[scenarios]
+        covered = cost[scenarios] - out_of_pocket
+        expected_covered += covered @ probabilities[scenarios]
+        covered **= 2
+        covered_variance += covered @ event_variances[scenarios]
+    premium = expected_covered * (1 + loading) + risk_loading * np.sqrt(covered_variance)
+
+    grid = np.meshgrid(deductibles, copayment_percentages, coverage_limits, indexing="ij")
+    return {
+        "annual_deductible": grid[0].ravel(),
+        "copayment_percentage": grid[1].ravel(),
+        "coverage_limit": grid[2].ravel(),
+        "annual_premium": premium.reshape(-1),
+        "expected_out_of_pocket": expected_out_of_pocket.reshape(-1),
+    }
+
+
+def pareto_front(premium: np.ndarray, out_of_pocket: np.ndarray) -> np.ndarray:
+    """Indices of the non-dominated points (minimising both), by ascending premium."""
+    order = np.lexsort((out_of_pocket, premium))
+    sorted_oop = out_of_pocket[order]
+    best_so_far = np.minimum.accumulate(sorted_oop)
+    previous_best = np.concatenate(([np.inf], best_so_far[:-1]))
+    return order[sorted_oop < previous_best]
+
+
+def optimize(
+    scenarios: Sequence,
+    age: int,
+    deductibles: np.ndarray,
+    copayment_percentages: np.ndarray,
+    coverage_limits: np.ndarray,
+    loading: float = DEFAULT_LOADING,
+    risk_loading: float = DEFAULT_RISK_LOADING,
+    reference_plans: Sequence = (),
+    max_points: int = 50,
+) -> dict:
+    """Pareto-optimal plan designs for a character of the given age.
+
+    Fine grids give fronts with thousands of points; they are thinned to
+    ``max_points`` evenly spaced ones, always keeping both ends.
+    """
+    treatment_costs = np.array([s.treatment_cost for s in scenarios], dtype=np.float64)
+    probabilities = simulation.event_probabilities(scenarios, age)
+    scores = score_grid(
+        deductibles, copayment_percentages, coverage_limits, treatment_costs, probabilities, loading, risk_loading
+    )
+
+    front = pareto_front(scores["annual_premium"], scores["expected_out_of_pocket"])
+    front_size = len(front)
+    if front_size > max_points:
+        front = front[np.unique(np.linspace(0, front_size - 1, max_points).round().astype(int))]
+    columns = {
+        name: scores[name][front].tolist()
+        for name in ("annual_deductible", "copayment_percentage", "coverage_limit",
+                     "annual_premium", "expected_out_of_pocket")
+    }
+    pareto = [
+        {
+            "annual_deductible": columns["annual_deductible"][i],
+            "copayment_percentage": columns["copayment_percentage"][i],
+            "coverage_limit": columns["coverage_limit"][i],
+            "monthly_premium": columns["annual_premium"][i] / 12,
+            "annual_premium": columns["annual_premium"][i],
+            "expected_out_of_pocket": columns["expected_out_of_pocket"][i],
+            "expected_total_cost": columns["annual_premium"][i] + columns["expected_out_of_pocket"][i],
+        }
+        for i in range(len(front))
+    ]
+
+    # The catalog's own plans, at their listed premiums, for comparison
+    reference = []
+    if reference_plans:
+        plan_columns = outcome_engine.plan_arrays(reference_plans)
+        plan_oop = outcome_engine.total_out_of_pocket(
+            treatment_costs[None, :],
+            plan_columns["annual_deductible"][:, None],
+            plan_columns["copayment_percentage"][:, None] / 100,
+            plan_columns["coverage_limit"][:, None],
+        ) @ probabilities
+        for plan, expected_oop in zip(reference_plans, plan_oop.tolist()):
+            annual_premium = plan.monthly_premium * 12
+            reference.append({
+                "insurance_option_id": plan.id,
+                "annual_premium": annual_premium,
+                "expected_out_of_pocket": expected_oop,
+                "expected_total_cost": annual_premium + expected_oop,
+            })
+
+    return {
+        "age": age,
+        "candidates": int(scores["annual_premium"].size),
+        "front_size": front_size,
+        "pareto_front": pareto,
+        "catalog_plans": reference,
+    }
@@ -0,0 +1,142 @@
+"""Vectorized out-of-pocket cost engine.
+
+Evaluates every (plan, scenario) pair in one NumPy pass. Characters never
+change the arithmetic, only which plan applies to them, so per-character
+results are a row lookup into the plan x scenario matrix.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Out-of-pocket thresholds separating "Low" / "Medium" / "High" impact
+IMPACT_THRESHOLDS = np.array([2000.0, 10000.0])
+IMPACT_LABELS = np.array(["Low", "Medium", "High"])
+
+
+@dataclass(frozen=True)
+class OutcomeMatrix:
+    """Per-(plan, scenario) cost breakdown, every array shaped (plans, scenarios)."""
+    treatment_cost: np.ndarray
+    deductible_cost: np.ndarray
+    copayment_cost: np.ndarray
+    excess_cost: np.ndarray
+    out_of_pocket_cost: np.ndarray
+    insurance_covered: np.ndarray
+    financial_impact: np.ndarray
+
+
+def plan_arrays(plans: Sequence) -> Dict[str, np.ndarray]:
+    """Column arrays for the plan fields the cost model uses."""
+    return {
+        "annual_deductible": np.array([p.annual_deductible for p in plans], dtype=np.float64),
+        "copayment_percentage": np.array([p.copayment_percentage for p in plans], dtype=np.float64),
+        "coverage_limit": np.array([p.coverage_limit for p in plans], dtype=np.float64),
+        "monthly_premium": np.array([p.monthly_premium for p in plans], dtype=np.float64),
+    }
+
+
+def classify_impact(out_of_pocket: np.ndarray) -> np.ndarray:
+    """Map out-of-pocket amounts onto the "Low" / "Medium" / "High" buckets."""
+    return IMPACT_LABELS[np.digitize(out_of_pocket, IMPACT_THRESHOLDS)]
+
+
+def cost_components(treatment_cost, deductible, copay_rate, coverage_limit):
+    """Deductible, copayment and over-limit excess for broadcastable arrays.
+
+    ``copay_rate`` is a fraction (0.1 for 10%). Returns the three components.
+    """
+    deductible_cost = np.minimum(deductible, treatment_cost)
+    copayment_cost = np.maximum(0.0, treatment_cost - deductible) * copay_rate
+    excess_cost = np.maximum(0.0, treatment_cost - coverage_limit)
+    return deductible_cost, copayment_cost, excess_cost
+
+
+def total_out_of_pocket(treatment_cost, deductible, copay_rate, coverage_limit):
+    """Sum of ``cost_components``."""
+    deductible_cost, copayment_cost, excess_cost = cost_components(treatment_cost, deductible, copay_rate, coverage_limit)
+    return deductible_cost + copayment_cost + excess_cost
+
+
+def compute_outcome_matrix(
+    treatment_costs: np.ndarray,
+    annual_deductibles: np.ndarray,
+    copayment_percentages: np.ndarray,
+    coverage_limits: np.ndarray,
+) -> OutcomeMatrix:
+    """Cost breakdown for every plan against every scenario.
+
+    Plan arrays are 1-D of length P, ``treatment_costs`` is 1-D of length S.
+    """
+    cost = np.asarray(treatment_costs, dtype=np.float64)[np.newaxis, :]
+    deductible = np.asarray(annual_deductibles, dtype=np.float64)[:, np.newaxis]
+    copay_rate = np.asarray(copayment_percentages, dtype=np.float64)[:, np.newaxis] / 100
+    limit = np.asarray(coverage_limits, dtype=np.float64)[:, np.newaxis]
+
+    deductible_cost, copayment_cost, excess_cost = cost_components(cost, deductible, copay_rate, limit)
+    total = deductible_cost + copayment_cost + excess_cost
+    cost = np.broadcast_to(cost, total.shape)
+
+    return OutcomeMatrix(
+        treatment_cost=cost,
+        deductible_cost=deductible_cost,
+        copayment_cost=copayment_cost,
+        excess_cost=excess_cost,
+        out_of_pocket_cost=total,
+        insurance_covered=cost - total,
+        financial_impact=classify_impact(total),
+    )
+
+
+def evaluate(plans: Sequence, scenarios: Sequence) -> OutcomeMatrix:
+    """Run the cost model for catalog objects (anything with the model attributes)."""
+    columns = plan_arrays(plans)
+    costs = np.array([s.treatment_cost for s in scenarios], dtype=np.float64)
+    return compute_outcome_matrix(
+        costs,
+        columns["annual_deductible"],
+        columns["copayment_percentage"],
+        columns["coverage_limit"],
+    )
+
+
+def outcome_records(plans: Sequence, scenarios: Sequence) -> List[List[dict]]:
+    """Plain-Python outcome dicts indexed ``[plan][scenario]``, ready for JSON."""
+    matrix = evaluate(plans, scenarios)
+    treatment = matrix.treatment_cost.tolist()
+    deductible = matrix.deductible_cost.tolist()
+    copayment = matrix.copayment_cost.tolist()
+    excess = matrix.excess_cost.tolist()
+    out_of_pocket = matrix.out_of_pocket_cost.tolist()
+    covered = matrix.insurance_covered.tolist()
+    impact = matrix.financial_impact.tolist()
+
+    records = []
+    for i, plan in enumerate(plans):
+        row = []
+        for j in range(len(scenarios)):
+            row.append({
+                "insurance_option_id": plan.id,
+                "insurance_plan": plan.name,
+                "total_treatment_cost": treatment[i][j],
+                "deductible_cost": deductible[i][j],
+                "copayment_cost": copayment[i][j],
+                "excess_cost": excess[i][j],
+                "out_of_pocket_cost": out_of_pocket[i][j],
+                "insurance_covered": covered[i][j],
+                "financial_impact": impact[i][j],
+                "monthly_premium": plan.monthly_premium,
+                "annual_premium": plan.monthly_premium * 12,
+            })
+        records.append(row)
+    return records
+
+
+def build_outcome_table(plans: Sequence, scenarios: Sequence) -> Dict[Tuple[str, str], dict]:
+    """Every outcome record keyed by ``(insurance_option_id, scenario_id)``."""
+    records = outcome_records(plans, scenarios)
+    return {
+        (plan.id, scenario.id): records[i][j]
+        for i, plan in enumerate(plans)
+        for j, scenario in enumerate(scenarios)
+    }
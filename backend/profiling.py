@@ -0,0 +1,179 @@
+"""Per-request timing breakdown and opt-in profiling.
+
+``ServerTimingMiddleware`` adds a ``Server-Timing`` header to every response
+splitting the request into:
+
+    validation     request start until the endpoint is called (body parsing,
+                   dependency resolution, Pydantic validation)
+    db             time spent awaiting MongoDB inside the request
+    compute        endpoint time minus db
+    serialization  endpoint return until the response starts
+    total
+
+The endpoint boundaries come from ``TimedRoute``, used as the API router's
+``route_class``; db time is reported by ``metrics.InstrumentedCollection``.
+
+``ProfilingMiddleware`` is only installed when ``PROFILING_ENABLED`` is set.
+A request to ``/api`` with ``X-Profile: 1`` or ``?profile=1`` then runs
+under cProfile and the stats are written to ``PROFILE_DIR``; the file name
+is returned in ``X-Profile-File``. cProfile follows the thread, so other
+requests interleaved on the event loop show up in the same profile. Only
+one profiler can run per thread, so a profile requested while another is
+running gets a 409.
+"""
+import asyncio
+import contextvars
+import cProfile
+import os
+import time
+import uuid
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders, QueryParams
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RequestTiming:
+    __slots__ = ("start", "endpoint_start", "endpoint_end", "db")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.endpoint_start: Optional[float] = None
+        self.endpoint_end: Optional[float] = None
+        self.db = 0.0
+
+    def server_timing(self, response_start: float) -> str:
+        total = response_start - self.start
+        if self.endpoint_start is None or self.endpoint_end is None:
+            return f"total;dur={total * 1000:.3f}"
+        endpoint = self.endpoint_end - self.endpoint_start
+        phases = (
+            ("validation", self.endpoint_start - self.start),
+            ("db", self.db),
+            ("compute", max(0.0, endpoint - self.db)),
+            ("serialization", response_start - self.endpoint_end),
+            ("total", total),
+        )
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in phases)
+
+
+_current_timing: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    "request_timing", default=None
+)
+
+
+def add_db_time(seconds: float):
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.db += seconds
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that records when its endpoint starts and returns."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        # The request handler reads dependant.call on every request, but it
+        # decided at construction whether to await it or run it in a thread,
+        # so the wrapper must keep the endpoint's kind
+        call = self.dependant.call
+
+        if asyncio.iscoroutinefunction(call):
+            async def timed_call(**values):
+                timing = _endpoint_started()
+                try:
+                    return await call(**values)
+                finally:
+                    _endpoint_finished(timing)
+        else:
+            def timed_call(**values):
+                timing = _endpoint_started()
+                try:
+                    return call(**values)
+                finally:
+                    _endpoint_finished(timing)
+
+        self.dependant.call = timed_call
+
+
+def _endpoint_started() -> Optional[RequestTiming]:
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.endpoint_start = time.perf_counter()
+    return timing
+
+
+def _endpoint_finished(timing: Optional[RequestTiming]):
+    if timing is not None:
+        timing.endpoint_end = time.perf_counter()
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timing.server_timing(time.perf_counter()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timing.reset(token)
+
+
+def profiling_requested(scope: Scope) -> bool:
+    if not scope["path"].startswith("/api"):
+        return False
+    for name, value in scope["headers"]:
+        if name == b"x-profile" and value not in (b"", b"0"):
+            return True
+    return QueryParams(scope["query_string"]).get("profile") not in (None, "", "0")
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, output_dir: str):
+        self.app = app
+        self.output_dir = output_dir
+        self._running = False
+        os.makedirs(output_dir, exist_ok=True)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self._running:
+            response = JSONResponse({"detail": "Another request is being profiled; retry shortly"}, status_code=409)
+            await response(scope, receive, send)
+            return
+
+        route_name = scope["path"].strip("/").replace("/", "_") or "root"
+        filename = f"{int(time.time())}-{route_name}-{uuid.uuid4().hex[:8]}.prof"
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Profile-File", filename)
+            await send(message)
+
+        self._running = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            self._running = False
+            profiler.dump_stats(os.path.join(self.output_dir, filename))
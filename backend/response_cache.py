@@ -0,0 +1,104 @@
+"""Pre-serialized JSON responses with strong ETags.
+
+Payloads are encoded to bytes once (at startup or when the catalog changes)
+and served as-is, answering ``If-None-Match`` revalidations with 304.
+Their gzip and brotli variants are compressed at the same time and served
+to clients that accept them, each with its own ETag.
+"""
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+import compression
+import fast_json
+
+
+def encode_json(payload: Any) -> bytes:
+    """Encode like the app's default response class."""
+    return fast_json.dumps(jsonable_encoder(payload))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for ``If-None-Match`` (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    # Content coding -> compressed body
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        return f'{self.etag[:-1]}-{encoding}"' if encoding else self.etag
+
+
+class ResponseCache:
+    """Named, pre-encoded JSON bodies served with ETag and Cache-Control headers."""
+
+    def __init__(self, max_age: int = 300, minimum_size: int = compression.DEFAULT_MINIMUM_SIZE):
+        self.max_age = max_age
+        self.minimum_size = minimum_size
+        self._entries: Dict[str, CachedResponse] = {}
+
+    def _build(self, payload: Any) -> CachedResponse:
+        body = encode_json(payload)
+        return CachedResponse(
+            body=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            encoded=compression.precompress(body, self.minimum_size),
+        )
+
+    def set(self, key: str, payload: Any) -> CachedResponse:
+        entry = self._build(payload)
+        self._entries[key] = entry
+        return entry
+
+    def build_entries(self, payloads: Dict[str, Any]) -> Dict[str, CachedResponse]:
+        """Encode payloads without touching the live entries (safe to run in a thread)."""
+        return {key: self._build(payload) for key, payload in payloads.items()}
+
+    def swap(self, entries: Dict[str, CachedResponse]):
+        """Install a complete set of entries at once so readers never mix versions."""
+        self._entries = entries
+
+    def replace(self, payloads: Dict[str, Any]):
+        self.swap(self.build_entries(payloads))
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return self._entries.get(key)
+
+    def headers(self, entry: CachedResponse, encoding: Optional[str] = None) -> Dict[str, str]:
+        headers = {
+            "ETag": entry.etag_for(encoding),
+            "Cache-Control": f"public, max-age={self.max_age}",
+        }
+        if entry.encoded:
+            headers["Vary"] = "Accept-Encoding"
+        return headers
+
+    def respond(self, key: str, request: Request) -> Response:
+        entry = self._entries[key]
+        encoding = compression.negotiate(request.headers.get("accept-encoding"), entry.encoded)
+        headers = self.headers(entry, encoding)
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(content=entry.body, media_type="application/json", headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(content=entry.encoded[encoding], media_type="application/json", headers=headers)
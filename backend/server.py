@@ -1,49 +1,91 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
+import numpy as np
 from typing import List, Dict, Optional
+from contextlib import asynccontextmanager
+import asyncio
 import uuid
+import secrets
 from datetime import datetime
 
+import catalog_loader
+import compression
+import compute
+import decision_stats
+import export
+import jobs
+import metrics
+from fast_json import FastJSONResponse, model_response
+import optimizer
+import outcome_engine
+import profiling
+import simulation
+from catalog import Catalog
+from models import Character, InsuranceOption, Scenario
+from response_cache import ResponseCache, encode_json
+from session_store import MotorSessionStore, SessionStore, create_session_store
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Session storage, selected by SESSION_STORE ("mongo" or "memory")
+session_store = create_session_store()
+
+def get_session_store() -> SessionStore:
+    return session_store
+
+# Plan-choice analytics, refreshed in the background
+DECISION_STATS_TTL_SECONDS = int(os.environ.get('DECISION_STATS_TTL_SECONDS', '30'))
+decision_analytics = decision_stats.DecisionStats(
+    session_store,
+    ttl_seconds=DECISION_STATS_TTL_SECONDS,
+    full_refresh_seconds=int(os.environ.get('DECISION_STATS_FULL_REFRESH_SECONDS', '3600')),
+    overlap_seconds=float(os.environ.get('DECISION_STATS_OVERLAP_SECONDS', '5')),
+)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints stay disabled unless ADMIN_TOKEN is configured
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker process: connect to Mongo and warm the pool before
+    # the worker accepts requests; analytics are first built in the background
+    await session_store.start()
+    await compute_pool.start()
+    await projection_runner.start()
+    # A Mongo catalog is read through the session store's client when it has one
+    catalog_watcher = catalog_loader.create_catalog_watcher(
+        reload_catalog,
+        version=catalog.version,
+        db=session_store.db if isinstance(session_store, MotorSessionStore) else None,
+    )
+    await catalog_watcher.start()
+    decision_analytics.start()
+    yield
+    await decision_analytics.stop()
+    await catalog_watcher.stop()
+    await projection_runner.stop()
+    compute_pool.shutdown()
+    await session_store.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=profiling.TimedRoute)
 
 # Define Models
-class Character(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    age: int
-    occupation: str
-    current_health_status: str
-    lifestyle: str
-    insurance_choice: Optional[str] = None
-
-class InsuranceOption(BaseModel):
-    id: str
-    name: str
-    type: str  # "basic" or "enhanced"
-    monthly_premium: float
-    annual_deductible: float
-    copayment_percentage: float
-    coverage_limit: float
-    key_benefits: List[str]
-    
 class GameState(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: str
@@ -57,183 +99,157 @@ class Decision(BaseModel):
     insurance_option_id: str
     reasoning: Optional[str] = None
 
-class Scenario(BaseModel):
-    id: str
-    title: str
-    description: str
-    medical_situation: str
-    treatment_cost: float
-    urgency_level: str  # "low", "medium", "high"
-    category: str  # "emergency", "routine", "preventive", "specialist"
-    age_relevance: str  # "high", "medium", "low"
-    
 class DecisionCreate(BaseModel):
     session_id: str
     decision: Decision
 
+class DecisionBatchCreate(BaseModel):
+    decisions: List[DecisionCreate] = Field(..., min_length=1, max_length=1000)
+
 class GameStateCreate(BaseModel):
     session_id: str
 
-# Game Data
-INSURANCE_OPTIONS = [
-    InsuranceOption(
-        id="medishield_basic",
-        name="MediShield Life (Basic)",
-        type="basic",
-        monthly_premium=150.0,
-        annual_deductible=3000.0,
-        copayment_percentage=10.0,
-        coverage_limit=150000.0,
-        key_benefits=[
-            "Basic hospital coverage",
-            "Subsidized ward coverage",
-            "Emergency treatment",
-            "Day surgery procedures",
-            "Basic specialist consultations"
-        ]
-    ),
-    InsuranceOption(
-        id="integrated_shield",
-        name="Integrated Shield Plan",
-        type="enhanced",
-        monthly_premium=450.0,
-        annual_deductible=1000.0,
-        copayment_percentage=5.0,
-        coverage_limit=1000000.0,
-        key_benefits=[
-            "Private hospital coverage",
-            "Specialist consultations",
-            "Advanced treatments",
-            "Overseas emergency coverage",
-            "Cancer treatment coverage",
-            "Mental health support",
-            "Dental & optical coverage",
-            "Maternity benefits"
-        ]
-    )
-]
-
-CHARACTERS_DATA = [
-    Character(
-        id="alex",
-        name="Alex",
-        age=25,
-        occupation="Software Developer",
-        current_health_status="Generally healthy, occasional stress",
-        lifestyle="Sedentary work, exercises 2x weekly, healthy diet"
-    ),
-    Character(
-        id="jamie",
-        name="Jamie", 
-        age=28,
-        occupation="Marketing Executive",
-        current_health_status="Active lifestyle, family history of diabetes",
-        lifestyle="Very active, plays sports regularly, social drinker"
-    )
-]
-
-SCENARIOS = [
-    Scenario(
-        id="appendix_surgery",
-        title="Emergency Appendectomy",
-        description="Sudden severe abdominal pain requiring immediate surgery",
-        medical_situation="Emergency appendix removal with 3 days hospital stay",
-        treatment_cost=25000.0,
-        urgency_level="high",
-        category="emergency",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="cancer_diagnosis",
-        title="Early Cancer Diagnosis",
-        description="Routine check-up reveals early stage cancer requiring treatment",
-        medical_situation="Cancer treatment including chemotherapy and specialist care over 6 months",
-        treatment_cost=180000.0,
-        urgency_level="high",
-        category="specialist",
-        age_relevance="medium"
-    ),
-    Scenario(
-        id="broken_arm",
-        title="Sports Injury - Broken Arm",
-        description="Weekend basketball game results in fractured arm",
-        medical_situation="Orthopedic surgery with 3 months physiotherapy",
-        treatment_cost=15000.0,
-        urgency_level="medium",
-        category="emergency",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="dental_emergency",
-        title="Dental Emergency",
-        description="Severe tooth pain requires immediate root canal and crown",
-        medical_situation="Emergency dental treatment with follow-up procedures",
-        treatment_cost=3500.0,
-        urgency_level="medium",
-        category="routine",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="mental_health",
-        title="Mental Health Support",
-        description="Work stress leads to anxiety requiring professional counseling",
-        medical_situation="6 months of therapy sessions with psychiatrist consultation",
-        treatment_cost=4800.0,
-        urgency_level="medium",
-        category="specialist",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="maternity_care",
-        title="Maternity & Childbirth",
-        description="Pregnancy requires prenatal care and delivery",
-        medical_situation="Complete maternity package with specialist care",
-        treatment_cost=12000.0,
-        urgency_level="low",
-        category="routine",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="eye_surgery",
-        title="LASIK Eye Surgery",
-        description="Corrective eye surgery to eliminate dependence on glasses",
-        medical_situation="Bilateral LASIK surgery with follow-up care",
-        treatment_cost=8000.0,
-        urgency_level="low",
-        category="routine",
-        age_relevance="medium"
-    ),
-    Scenario(
-        id="heart_condition",
-        title="Heart Condition Discovery",
-        description="Routine health screening reveals heart irregularity",
-        medical_situation="Cardiac tests, specialist consultation, and ongoing monitoring",
-        treatment_cost=35000.0,
-        urgency_level="high",
-        category="specialist",
-        age_relevance="medium"
-    ),
-    Scenario(
-        id="accident_injury",
-        title="Traffic Accident",
-        description="Minor traffic accident results in multiple injuries",
-        medical_situation="Emergency room treatment, X-rays, and physical therapy",
-        treatment_cost=8500.0,
-        urgency_level="high",
-        category="emergency",
-        age_relevance="high"
-    ),
-    Scenario(
-        id="chronic_condition",
-        title="Chronic Condition Diagnosis",
-        description="Diagnosed with chronic condition requiring ongoing treatment",
-        medical_situation="Long-term medication and regular specialist visits",
-        treatment_cost=18000.0,
-        urgency_level="medium",
-        category="specialist",
-        age_relevance="medium"
-    )
-]
+class SimulationRequest(BaseModel):
+    years: int = Field(100_000, ge=1, le=1_000_000)
+    seed: Optional[int] = None
+    character_ids: Optional[List[str]] = None
+
+class ParameterRange(BaseModel):
+    min: float = Field(..., ge=0)
+    max: float = Field(..., ge=0)
+    steps: int = Field(10, ge=1, le=1000)
+
+    @model_validator(mode="after")
+    def check_bounds(self):
+        if self.max < self.min:
+            raise ValueError("max must not be below min")
+        return self
+
+    def values(self) -> np.ndarray:
+        return np.linspace(self.min, self.max, self.steps)
+
+class PlanOptimizationRequest(BaseModel):
+    character_id: Optional[str] = None
+    age: Optional[int] = Field(None, ge=0, le=120)
+    annual_deductible: ParameterRange = ParameterRange(min=0, max=5000, steps=21)
+    copayment_percentage: ParameterRange = ParameterRange(min=0, max=30, steps=31)
+    coverage_limit: ParameterRange = ParameterRange(min=50000, max=1000000, steps=20)
+    loading: float = Field(optimizer.DEFAULT_LOADING, ge=0, le=5)
+    risk_loading: float = Field(optimizer.DEFAULT_RISK_LOADING, ge=0, le=5)
+    scenario_ids: Optional[List[str]] = None
+    max_points: int = Field(50, ge=2, le=10000)
+
+    @model_validator(mode="after")
+    def check_grid_size(self):
+        candidates = self.annual_deductible.steps * self.copayment_percentage.steps * self.coverage_limit.steps
+        if candidates > optimizer.MAX_CANDIDATES:
+            raise ValueError(f"grid has {candidates} candidates; the limit is {optimizer.MAX_CANDIDATES}")
+        if self.copayment_percentage.max > 100:
+            raise ValueError("copayment_percentage cannot exceed 100")
+        return self
+
+class CohortMember(BaseModel):
+    id: str
+    age: int = Field(..., ge=0, le=120)
+    count: int = Field(1, ge=1, le=10_000_000)
+
+class ProjectionRequest(BaseModel):
+    cohort: Optional[List[CohortMember]] = Field(None, min_length=1, max_length=1000)
+    years: int = Field(20, ge=1, le=60)
+    paths: int = Field(10_000, ge=100, le=1_000_000)
+    seed: Optional[int] = None
+
+class OutcomeBatchRequest(BaseModel):
+    session_id: Optional[str] = None
+    scenario_ids: Optional[List[str]] = None
+    insurance_option_ids: Optional[List[str]] = None
+
+def build_comparison_stats(catalog: Catalog) -> dict:
+    basic_plan = catalog.insurance_options[0]
+    enhanced_plan = catalog.insurance_options[1]
+    
+    comparison_data = {
+        "basic_plan": {
+            "name": basic_plan.name,
+            "monthly_cost": basic_plan.monthly_premium,
+            "annual_cost": basic_plan.monthly_premium * 12,
+            "deductible": basic_plan.annual_deductible,
+            "copayment": basic_plan.copayment_percentage,
+            "coverage_limit": basic_plan.coverage_limit
+        },
+        "enhanced_plan": {
+            "name": enhanced_plan.name,
+            "monthly_cost": enhanced_plan.monthly_premium,
+            "annual_cost": enhanced_plan.monthly_premium * 12,
+            "deductible": enhanced_plan.annual_deductible,
+            "copayment": enhanced_plan.copayment_percentage,
+            "coverage_limit": enhanced_plan.coverage_limit
+        },
+        "cost_difference": {
+            "monthly": enhanced_plan.monthly_premium - basic_plan.monthly_premium,
+            "annual": (enhanced_plan.monthly_premium - basic_plan.monthly_premium) * 12
+        }
+    }
+    
+    return comparison_data
+
+# Process pool for the simulator and optimizer; 0 workers runs them in a thread
+compute_pool = compute.ComputePool(max_workers=int(os.environ.get('COMPUTE_WORKERS', '2')))
+
+# Long-running cohort projections, resumable across restarts
+job_store = jobs.create_job_store(session_store=session_store)
+projection_runner = jobs.ProjectionRunner(
+    job_store, compute_pool, lease_seconds=float(os.environ.get('JOB_LEASE_SECONDS', '120'))
+)
+
+# Catalog, its pre-serialized responses, scenario dicts and the precomputed
+# outcome table; swap them together via set_catalog()
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', str(compression.DEFAULT_MINIMUM_SIZE)))
+
+response_cache = ResponseCache(
+    max_age=int(os.environ.get('CATALOG_CACHE_MAX_AGE', '300')),
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+)
+
+def build_catalog_state(new_catalog: Catalog) -> tuple:
+    """Everything derived from a catalog; pure, so it can be built off the event loop"""
+    outcome_table = outcome_engine.build_outcome_table(new_catalog.insurance_options, new_catalog.scenarios)
+    comparison = build_comparison_stats(new_catalog)
+    cache_entries = response_cache.build_entries({
+        "insurance_options": new_catalog.insurance_options,
+        "characters": new_catalog.characters,
+        "scenarios": new_catalog.scenarios,
+        "stats_comparison": comparison,
+    })
+    # The bootstrap body up to its game_state value, as is and gzip-compressed
+    bootstrap_prefix = encode_json({
+        "characters": new_catalog.characters,
+        "insurance_options": new_catalog.insurance_options,
+        "scenarios": new_catalog.scenarios,
+        "comparison": comparison,
+    })[:-1] + b',"game_state":'
+    bootstrap_bodies = (bootstrap_prefix, compression.GzipPrefix(bootstrap_prefix))
+    scenario_payloads = {s.id: s.model_dump() for s in new_catalog.scenarios}
+    return outcome_table, cache_entries, scenario_payloads, bootstrap_bodies
+
+def set_catalog(new_catalog: Catalog, state: Optional[tuple] = None):
+    global catalog, outcome_table, scenario_payloads, bootstrap_bodies
+    if state is None:
+        state = build_catalog_state(new_catalog)
+    # No awaits below, so requests see either the old catalog or the new one
+    outcome_table, cache_entries, scenario_payloads, bootstrap_bodies = state
+    response_cache.swap(cache_entries)
+    catalog = new_catalog
+    compute_pool.set_catalog(new_catalog)
+
+async def reload_catalog(new_catalog: Catalog):
+    state = await asyncio.to_thread(build_catalog_state, new_catalog)
+    set_catalog(new_catalog, state)
+
+# Loaded from CATALOG_PATH at import; with CATALOG_SOURCE=mongo the lifespan
+# handler replaces it with the Mongo version before serving requests
+set_catalog(catalog_loader.load_catalog_file(os.environ.get('CATALOG_PATH', str(catalog_loader.DEFAULT_CATALOG_PATH))))
 
 # Routes
 @api_router.get("/")
@@ -241,152 +257,334 @@ async def root():
     return {"message": "MediShield Story Game API"}
 
 @api_router.get("/insurance-options", response_model=List[InsuranceOption])
-async def get_insurance_options():
-    return INSURANCE_OPTIONS
+async def get_insurance_options(request: Request):
+    return response_cache.respond("insurance_options", request)
 
 @api_router.get("/characters", response_model=List[Character])
-async def get_characters():
-    return CHARACTERS_DATA
+async def get_characters(request: Request):
+    return response_cache.respond("characters", request)
 
 @api_router.get("/scenarios", response_model=List[Scenario])
-async def get_scenarios():
-    return SCENARIOS
+async def get_scenarios(
+    request: Request,
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    age_relevance: Optional[str] = None,
+):
+    if category is None and urgency is None and age_relevance is None:
+        return response_cache.respond("scenarios", request)
+    scenarios = catalog.filter_scenarios(category=category, urgency_level=urgency, age_relevance=age_relevance)
+    return FastJSONResponse([scenario_payloads[s.id] for s in scenarios])
 
 @api_router.get("/scenarios/random/{count}")
 async def get_random_scenarios(count: int = 3):
     import random
-    if count > len(SCENARIOS):
-        count = len(SCENARIOS)
-    return random.sample(SCENARIOS, count)
+    if count > len(catalog.scenarios):
+        count = len(catalog.scenarios)
+    return FastJSONResponse([scenario_payloads[s.id] for s in random.sample(catalog.scenarios, count)])
 
-@api_router.post("/game/start", response_model=GameState)
-async def start_game(game_data: GameStateCreate):
+@api_router.get("/scenarios/{scenario_id}", response_model=Scenario)
+async def get_scenario(scenario_id: str):
+    scenario = catalog.get_scenario(scenario_id)
+    if not scenario:
+        raise HTTPException(status_code=404, detail="Scenario not found")
+    return FastJSONResponse(scenario_payloads[scenario_id])
+
+async def create_game_state(store: SessionStore, session_id: str) -> GameState:
     # Create new game state
     game_state = GameState(
-        session_id=game_data.session_id,
+        session_id=session_id,
         current_chapter=1,
-        characters=CHARACTERS_DATA.copy(),
+        characters=catalog.characters.copy(),
         completed_decisions={}
     )
     
-    # Save to database
-    await db.game_states.insert_one(game_state.dict())
-    return game_state
+    # Save to database; starting an existing session returns it unchanged
+    stored = await store.create(game_state.model_dump())
+    return GameState(**stored)
+
+@api_router.post("/game/start", response_model=GameState)
+async def start_game(game_data: GameStateCreate, store: SessionStore = Depends(get_session_store)):
+    return model_response(await create_game_state(store, game_data.session_id))
+
+@api_router.post("/bootstrap")
+async def bootstrap(request: Request, game_data: GameStateCreate, store: SessionStore = Depends(get_session_store)):
+    """Catalog data plus a freshly started game session in a single response"""
+    prefix, gzip_prefix = bootstrap_bodies
+    game_state = await create_game_state(store, game_data.session_id)
+    # Splice the session into the pre-serialized catalog object
+    rest = game_state.model_dump_json().encode() + b'}'
+    if compression.negotiate(request.headers.get("accept-encoding"), ("gzip",)) is None:
+        return Response(content=prefix + rest, media_type="application/json")
+    # Only the session is compressed per request
+    return Response(
+        content=gzip_prefix.complete(rest),
+        media_type="application/json",
+        headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+    )
 
 @api_router.get("/game/{session_id}", response_model=GameState)
-async def get_game_state(session_id: str):
-    game_state = await db.game_states.find_one({"session_id": session_id})
+async def get_game_state(session_id: str, store: SessionStore = Depends(get_session_store)):
+    game_state = await store.get(session_id)
     if not game_state:
         raise HTTPException(status_code=404, detail="Game session not found")
-    return GameState(**game_state)
+    return model_response(GameState(**game_state))
 
-@api_router.post("/game/decision")
-async def make_decision(decision_data: DecisionCreate):
-    # Find game state
-    game_state = await db.game_states.find_one({"session_id": decision_data.session_id})
-    if not game_state:
+@api_router.get("/game/{session_id}/history")
+async def get_game_history(session_id: str, store: SessionStore = Depends(get_session_store)):
+    """The session's decisions in the order they were made"""
+    events = await store.history(session_id)
+    if events is None:
         raise HTTPException(status_code=404, detail="Game session not found")
+    return FastJSONResponse({"session_id": session_id, "events": events})
+
+@api_router.post("/game/decision")
+async def make_decision(decision_data: DecisionCreate, store: SessionStore = Depends(get_session_store)):
+    decision = decision_data.decision
+    if not catalog.get_character(decision.character_id):
+        raise HTTPException(status_code=404, detail="Character not found")
+    if not catalog.get_insurance_option(decision.insurance_option_id):
+        raise HTTPException(status_code=404, detail="Insurance option not found")
     
-    # Update character insurance choice
-    for character in game_state["characters"]:
-        if character["id"] == decision_data.decision.character_id:
-            character["insurance_choice"] = decision_data.decision.insurance_option_id
-            break
-    
-    # Update completed decisions
-    game_state["completed_decisions"][decision_data.decision.character_id] = decision_data.decision.insurance_option_id
-    
-    # Save updated state
-    await db.game_states.update_one(
-        {"session_id": decision_data.session_id},
-        {"$set": game_state}
+    recorded = await store.record_decision(
+        decision_data.session_id, decision.character_id, decision.insurance_option_id
     )
+    if not recorded:
+        raise HTTPException(status_code=404, detail="Game session not found")
     
     return {"message": "Decision recorded successfully"}
 
+@api_router.post("/game/decisions")
+async def make_decisions(batch: DecisionBatchCreate, store: SessionStore = Depends(get_session_store)):
+    """Record decisions for one or many sessions; each item gets its own result"""
+    results = [None] * len(batch.decisions)
+    valid = []
+    for index, item in enumerate(batch.decisions):
+        decision = item.decision
+        if not catalog.get_character(decision.character_id):
+            results[index] = (404, "Character not found")
+        elif not catalog.get_insurance_option(decision.insurance_option_id):
+            results[index] = (404, "Insurance option not found")
+        else:
+            valid.append(index)
+
+    recorded = await store.record_decisions([
+        (batch.decisions[i].session_id, batch.decisions[i].decision.character_id,
+         batch.decisions[i].decision.insurance_option_id)
+        for i in valid
+    ])
+    for index, ok in zip(valid, recorded):
+        results[index] = (200, "Decision recorded successfully") if ok else (404, "Game session not found")
+
+    return FastJSONResponse({
+        "recorded": sum(1 for status, _ in results if status == 200),
+        "failed": sum(1 for status, _ in results if status != 200),
+        "results": [
+            {
+                "session_id": item.session_id,
+                "character_id": item.decision.character_id,
+                "status": status,
+                "detail": detail,
+            }
+            for item, (status, detail) in zip(batch.decisions, results)
+        ]
+    })
+
 @api_router.post("/game/calculate-outcome")
-async def calculate_outcome(session_id: str, scenario_id: str):
+async def calculate_outcome(session_id: str, scenario_id: str, store: SessionStore = Depends(get_session_store)):
     # Get game state
-    game_state = await db.game_states.find_one({"session_id": session_id})
+    game_state = await store.get(session_id)
     if not game_state:
         raise HTTPException(status_code=404, detail="Game session not found")
     
     # Find scenario
-    scenario = next((s for s in SCENARIOS if s.id == scenario_id), None)
+    scenario = catalog.get_scenario(scenario_id)
     if not scenario:
         raise HTTPException(status_code=404, detail="Scenario not found")
     
-    # Calculate outcomes for each character
+    # Look up the precomputed outcome for each character's plan
     outcomes = {}
     for character in game_state["characters"]:
-        if character["insurance_choice"]:
-            insurance = next((ins for ins in INSURANCE_OPTIONS if ins.id == character["insurance_choice"]), None)
-            if insurance:
-                # Calculate out-of-pocket cost
-                deductible_cost = min(insurance.annual_deductible, scenario.treatment_cost)
-                remaining_cost = max(0, scenario.treatment_cost - insurance.annual_deductible)
-                copayment_cost = remaining_cost * (insurance.copayment_percentage / 100)
-                total_out_of_pocket = deductible_cost + copayment_cost
-                
-                # Check if within coverage limit
-                if scenario.treatment_cost > insurance.coverage_limit:
-                    excess_cost = scenario.treatment_cost - insurance.coverage_limit
-                    total_out_of_pocket += excess_cost
-                
-                # Determine financial impact
-                if total_out_of_pocket < 2000:
-                    financial_impact = "Low"
-                elif total_out_of_pocket < 10000:
-                    financial_impact = "Medium"
-                else:
-                    financial_impact = "High"
-                
-                outcomes[character["id"]] = {
-                    "character_name": character["name"],
-                    "insurance_plan": insurance.name,
-                    "total_treatment_cost": scenario.treatment_cost,
-                    "out_of_pocket_cost": total_out_of_pocket,
-                    "insurance_covered": scenario.treatment_cost - total_out_of_pocket,
-                    "financial_impact": financial_impact,
-                    "monthly_premium": insurance.monthly_premium,
-                    "annual_premium": insurance.monthly_premium * 12
-                }
+        record = outcome_table.get((character["insurance_choice"], scenario_id))
+        if record:
+            outcomes[character["id"]] = {"character_name": character["name"], **record}
     
-    return {
-        "scenario": scenario.dict(),
+    return FastJSONResponse({
+        "scenario": scenario_payloads[scenario_id],
         "outcomes": outcomes
-    }
+    })
 
-@api_router.get("/stats/comparison")
-async def get_insurance_comparison_stats():
-    """Get detailed comparison statistics between insurance plans"""
-    basic_plan = INSURANCE_OPTIONS[0]
-    enhanced_plan = INSURANCE_OPTIONS[1]
+@api_router.post("/game/calculate-outcomes")
+async def calculate_outcomes(request: OutcomeBatchRequest, store: SessionStore = Depends(get_session_store)):
+    """Outcomes for every (character, plan, scenario) combination in one call"""
+    if request.session_id:
+        game_state = await store.get(request.session_id)
+        if not game_state:
+            raise HTTPException(status_code=404, detail="Game session not found")
+        characters = game_state["characters"]
+    else:
+        characters = [c.model_dump() for c in catalog.characters]
+
+    scenarios = catalog.scenarios
+    if request.scenario_ids is not None:
+        missing = [sid for sid in request.scenario_ids if sid not in catalog.scenarios_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Scenario not found: {', '.join(missing)}")
+        scenarios = [catalog.scenarios_by_id[sid] for sid in request.scenario_ids]
+
+    plans = catalog.insurance_options
+    if request.insurance_option_ids is not None:
+        missing = [pid for pid in request.insurance_option_ids if pid not in catalog.insurance_options_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Insurance option not found: {', '.join(missing)}")
+        plans = [catalog.insurance_options_by_id[pid] for pid in request.insurance_option_ids]
+
+    outcomes = {}
+    for scenario in scenarios:
+        plan_outcomes = {plan.id: outcome_table[(plan.id, scenario.id)] for plan in plans}
+        outcomes[scenario.id] = {
+            character["id"]: {
+                "character_name": character["name"],
+                "insurance_choice": character.get("insurance_choice"),
+                "plans": plan_outcomes,
+            }
+            for character in characters
+        }
+
+    return FastJSONResponse({
+        "scenarios": [scenario_payloads[s.id] for s in scenarios],
+        "outcomes": outcomes
+    })
+
+@api_router.post("/simulate")
+async def simulate_annual_costs(request: SimulationRequest):
+    """Monte Carlo distribution of yearly out-of-pocket cost per character and plan"""
+    if request.character_ids is not None:
+        missing = [cid for cid in request.character_ids if cid not in catalog.characters_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Character not found: {', '.join(missing)}")
+
+    # Always report the seed so any run can be reproduced
+    seed = request.seed if request.seed is not None else secrets.randbits(32)
+    results = await compute_pool.run(
+        "simulate", compute.simulate_task, request.character_ids, request.years, seed
+    )
     
-    comparison_data = {
-        "basic_plan": {
-            "name": basic_plan.name,
-            "monthly_cost": basic_plan.monthly_premium,
-            "annual_cost": basic_plan.monthly_premium * 12,
-            "deductible": basic_plan.annual_deductible,
-            "copayment": basic_plan.copayment_percentage,
-            "coverage_limit": basic_plan.coverage_limit
+    return FastJSONResponse({
+        "years": request.years,
+        "seed": seed,
+        "results": results
+    })
+
+@api_router.post("/plans/optimize")
+async def optimize_plans(request: PlanOptimizationRequest):
+    """Pareto front of premium vs expected out-of-pocket over a deductible/copay/limit grid"""
+    age = request.age if request.age is not None else simulation.REFERENCE_AGE
+    if request.character_id is not None:
+        character = catalog.get_character(request.character_id)
+        if not character:
+            raise HTTPException(status_code=404, detail="Character not found")
+        age = character.age
+
+    if request.scenario_ids is not None:
+        missing = [sid for sid in request.scenario_ids if sid not in catalog.scenarios_by_id]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Scenario not found: {', '.join(missing)}")
+
+    # Validated and submitted without an await, so the pool has the same catalog
+    return FastJSONResponse(await compute_pool.run(
+        "optimize",
+        compute.optimize_task,
+        request.scenario_ids,
+        age,
+        request.annual_deductible.values(),
+        request.copayment_percentage.values(),
+        request.coverage_limit.values(),
+        request.loading,
+        request.risk_loading,
+        request.max_points,
+    ))
+
+@api_router.post("/jobs/projection", status_code=202)
+async def start_projection_job(request: ProjectionRequest):
+    """Queue a multi-year cohort cost projection; poll GET /api/jobs/{job_id} for progress"""
+    cohort = request.cohort
+    if cohort is None:
+        cohort = [CohortMember(id=c.id, age=c.age) for c in catalog.characters]
+    ids = [member.id for member in cohort]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=422, detail="Cohort member ids must be unique")
+
+    seed = request.seed if request.seed is not None else secrets.randbits(32)
+    job = jobs.new_job(
+        params={
+            "cohort": [member.model_dump() for member in cohort],
+            "years": request.years,
+            "paths": request.paths,
+            "seed": seed,
         },
-        "enhanced_plan": {
-            "name": enhanced_plan.name,
-            "monthly_cost": enhanced_plan.monthly_premium,
-            "annual_cost": enhanced_plan.monthly_premium * 12,
-            "deductible": enhanced_plan.annual_deductible,
-            "copayment": enhanced_plan.copayment_percentage,
-            "coverage_limit": enhanced_plan.coverage_limit
+        # Snapshot the plans and scenarios so a resumed job ignores later catalog changes
+        inputs={
+            "catalog_version": catalog.version,
+            "insurance_options": [plan.model_dump() for plan in catalog.insurance_options],
+            "scenarios": list(scenario_payloads.values()),
         },
-        "cost_difference": {
-            "monthly": enhanced_plan.monthly_premium - basic_plan.monthly_premium,
-            "annual": (enhanced_plan.monthly_premium - basic_plan.monthly_premium) * 12
-        }
-    }
-    
-    return comparison_data
+        total_chunks=request.years,
+    )
+    await job_store.create(job)
+    projection_runner.notify()
+    return FastJSONResponse(jobs.job_view(job), status_code=202)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    include_results: bool = False,
+    from_year: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Job progress and cohort summary; ``include_results`` adds a page of per-member results"""
+    job = await job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Results run to megabytes for a long job, so polls get the summary only
+    results = await job_store.results(job_id, start=from_year - 1, limit=limit) if include_results else None
+    return FastJSONResponse(jobs.job_view(job, await job_store.cohort_totals(job_id), results))
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one after its current chunk"""
+    job = await job_store.request_cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(jobs.job_view(job, await job_store.cohort_totals(job_id)))
+
+@api_router.get("/admin/export", dependencies=[Depends(require_admin)])
+async def export_sessions(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    after_session_id: Optional[str] = None,
+    batch_size: int = Query(500, ge=1, le=10000),
+    store: SessionStore = Depends(get_session_store),
+):
+    """Stream sessions as NDJSON or CSV, resumable from a (created_at, session_id) watermark"""
+    sessions = store.iter_sessions(export.to_naive_utc(since), after_session_id, batch_size)
+    return StreamingResponse(
+        export.stream_export(sessions, export_format),
+        media_type=export.MEDIA_TYPES[export_format]
+    )
+
+@api_router.get("/stats/comparison")
+async def get_insurance_comparison_stats(request: Request):
+    """Get detailed comparison statistics between insurance plans"""
+    return response_cache.respond("stats_comparison", request)
+
+@api_router.get("/stats/decisions")
+async def get_decision_stats():
+    """Plan-choice counts and rates per character, per age band and per day"""
+    return FastJSONResponse(
+        await decision_analytics.get(),
+        headers={"Cache-Control": f"public, max-age={DECISION_STATS_TTL_SECONDS}"}
+    )
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -398,6 +596,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(compression.CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiling.ServerTimingMiddleware)
+# Debug only: profile individual /api requests on demand
+if os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes'):
+    app.add_middleware(profiling.ProfilingMiddleware, output_dir=os.environ.get('PROFILE_DIR', '/tmp/profiles'))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 # Configure logging
 logging.basicConfig(
@@ -405,7 +613,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
@@ -0,0 +1,372 @@
+"""Write-behind LRU cache in front of the ``game_states`` collection.
+
+Reads are served from memory once a session has been loaded. Decisions
+update the cached document immediately and become events (see
+``game_events``), appended to ``game_events`` with periodic unordered
+``insert_many`` batches. Every ``snapshot_interval`` seconds the sessions
+with new events are written back to ``game_states`` as snapshots in one
+``bulk_write``. A session loaded from Mongo is its snapshot with the
+later events replayed.
+
+Concurrent misses for the same session share one ``find_one``. Lookups
+of unknown sessions can optionally be remembered for ``miss_ttl`` seconds.
+
+The cache is per process, so the API runs as a single worker with it:
+other processes serving the same sessions would read stale copies, and
+their writes would conflict. ``SESSION_CACHE=off`` turns it off for
+multi-worker deployments.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo.errors import BulkWriteError
+
+import game_events
+from metrics import SESSION_READS_COALESCED, SESSION_WRITE_CONFLICTS
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache:
+    def __init__(
+        self,
+        collection,
+        events=None,
+        max_size: int = 10000,
+        idle_seconds: float = 300.0,
+        flush_interval: float = 1.0,
+        snapshot_interval: float = 10.0,
+        miss_ttl: float = 0.0,
+    ):
+        self.collection = collection
+        self.events = events
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        self.miss_ttl = miss_ttl
+        # session_id -> in-flight find_one shared by concurrent readers
+        self._loading: Dict[str, asyncio.Task] = {}
+        # session_id -> monotonic time until which it is known not to exist
+        self._misses: Dict[str, float] = {}
+        # session_id -> (document, last access time), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # session_id -> events not yet written to Mongo, in seq order
+        self._pending: Dict[str, List[dict]] = {}
+        # Events handed to an insert_many that has not completed yet
+        self._in_flight: Dict[str, List[dict]] = {}
+        # Sessions whose stored snapshot is behind their written events
+        self._unsnapshotted: Set[str] = set()
+        self._last_snapshot = time.monotonic()
+        # Serializes flushes and snapshots from the background loop and request paths
+        self._write_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, document: dict):
+        session_id = document["session_id"]
+        self._misses.pop(session_id, None)
+        self._entries[session_id] = (document, time.monotonic())
+        self._entries.move_to_end(session_id)
+        self._evict_overflow()
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        entry = self._entries.get(session_id)
+        if entry:
+            self._entries[session_id] = (entry[0], time.monotonic())
+            self._entries.move_to_end(session_id)
+            return entry[0]
+        if self._is_known_missing(session_id):
+            return None
+
+        task = self._loading.get(session_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(session_id))
+            self._loading[session_id] = task
+            task.add_done_callback(lambda done: self._loading_done(session_id, done))
+        else:
+            SESSION_READS_COALESCED.inc()
+        # Shielded so a cancelled reader does not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, session_id: str) -> Optional[dict]:
+        document = await self.collection.find_one({"session_id": session_id})
+        events = []
+        if document:
+            events = await self.events.find(
+                {"session_id": session_id, "seq": {"$gt": game_events.snapshot_seq(document)}}
+            ).to_list(None)
+        # Another request may have loaded (and modified) the session meanwhile
+        entry = self._entries.get(session_id)
+        if entry:
+            return entry[0]
+        if document:
+            self._put_replayed(document, events)
+        else:
+            self._remember_miss(session_id)
+        return document
+
+    def _put_replayed(self, document: dict, events: List[dict]):
+        game_events.replay(document, events)
+        self.put(document)
+        if events:
+            # Events written before a restart; fold them in at the next snapshot
+            self._unsnapshotted.add(document["session_id"])
+
+    def _loading_done(self, session_id: str, task: asyncio.Task):
+        if self._loading.get(session_id) is task:
+            del self._loading[session_id]
+        if not task.cancelled():
+            # Mark the exception retrieved; the readers awaiting it re-raise it
+            task.exception()
+
+    def _is_known_missing(self, session_id: str) -> bool:
+        expires = self._misses.get(session_id)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del self._misses[session_id]
+        return False
+
+    def _remember_miss(self, session_id: str):
+        if self.miss_ttl <= 0:
+            return
+        if len(self._misses) >= self.max_size:
+            self._misses.clear()
+        self._misses[session_id] = time.monotonic() + self.miss_ttl
+
+    async def get_many(self, session_ids: Iterable[str]) -> Dict[str, dict]:
+        """Cached sessions plus the missing ones, loaded with a single query."""
+        found = {}
+        loading = {}
+        missing = []
+        now = time.monotonic()
+        for session_id in set(session_ids):
+            entry = self._entries.get(session_id)
+            if entry:
+                self._entries[session_id] = (entry[0], now)
+                self._entries.move_to_end(session_id)
+                found[session_id] = entry[0]
+            elif session_id in self._loading:
+                loading[session_id] = self._loading[session_id]
+            elif not self._is_known_missing(session_id):
+                missing.append(session_id)
+
+        if missing:
+            documents = await self.collection.find({"session_id": {"$in": missing}}).to_list(None)
+            events = {}
+            if documents:
+                events = game_events.group_by_session(
+                    await self.events.find(game_events.events_after_filter(documents)).to_list(None)
+                )
+            for document in documents:
+                session_id = document["session_id"]
+                entry = self._entries.get(session_id)
+                if entry:
+                    found[session_id] = entry[0]
+                else:
+                    self._put_replayed(document, events.get(session_id, []))
+                    found[session_id] = document
+            for session_id in missing:
+                if session_id not in found:
+                    self._remember_miss(session_id)
+        # Join loads already started by concurrent single-session reads
+        for session_id, task in loading.items():
+            SESSION_READS_COALESCED.inc()
+            document = await asyncio.shield(task)
+            if document:
+                found[session_id] = document
+        return found
+
+    def _apply_decision(self, document: Optional[dict], character_id: str, insurance_option_id: str) -> bool:
+        if not document or not game_events.apply_decision(document, character_id, insurance_option_id):
+            return False
+        seq = game_events.event_seq(document) + 1
+        document["event_seq"] = seq
+        session_id = document["session_id"]
+        event = game_events.decision_event(session_id, seq, character_id, insurance_option_id)
+        self._pending.setdefault(session_id, []).append(event)
+        return True
+
+    async def record_decision(self, session_id: str, character_id: str, insurance_option_id: str) -> bool:
+        """Apply a decision to the cached session; False if the session or character is unknown."""
+        return self._apply_decision(await self.get(session_id), character_id, insurance_option_id)
+
+    async def record_decisions(self, decisions: List[Tuple[str, str, str]]) -> List[bool]:
+        """Apply (session_id, character_id, insurance_option_id) decisions in order.
+
+        All the sessions are loaded in one query, and the next flush writes the
+        events in the same ``insert_many``.
+        """
+        documents = await self.get_many(session_id for session_id, _, _ in decisions)
+        return [
+            self._apply_decision(documents.get(session_id), character_id, option_id)
+            for session_id, character_id, option_id in decisions
+        ]
+
+    async def flush(self):
+        """Append the pending events to ``game_events``."""
+        async with self._write_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._in_flight = pending
+        events = [event for session_events in pending.values() for event in session_events]
+        failed = []
+        duplicates = []
+        try:
+            await self.events.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                (duplicates if error["code"] == 11000 else failed).append(events[error["index"]])
+        except Exception:
+            failed = events
+        finally:
+            self._in_flight = {}
+
+        conflicts = []
+        if duplicates:
+            try:
+                conflicts = await self._conflicting(duplicates)
+            except Exception:
+                logger.exception("Could not check duplicate session events")
+                failed += duplicates
+
+        retry = game_events.group_by_session(failed)
+        if failed:
+            logger.error(f"Failed to write {len(failed)} of {len(events)} session events; will retry")
+            # Retry before anything that arrived while the write was in flight
+            for session_id, session_events in retry.items():
+                self._pending[session_id] = sorted(
+                    session_events + self._pending.get(session_id, []), key=lambda e: e["seq"]
+                )
+        conflicted = game_events.group_by_session(conflicts)
+        if conflicted:
+            await self._rebase(conflicted)
+        self._unsnapshotted.update(
+            session_id for session_id in pending if session_id not in retry and session_id not in conflicted
+        )
+
+    async def _conflicting(self, duplicates: List[dict]) -> List[dict]:
+        """The duplicates whose stored event is a different decision.
+
+        The others were written by an earlier attempt of the same batch.
+        """
+        stored = await self.events.find({"_id": {"$in": [e["_id"] for e in duplicates]}}).to_list(None)
+        stored = {event["_id"]: event for event in stored}
+        return [event for event in duplicates if not game_events.same_event(event, stored.get(event["_id"]))]
+
+    async def _rebase(self, conflicts: Dict[str, List[dict]]):
+        """Reload sessions another process wrote to, and re-apply this process's decisions on top."""
+        for session_id, session_events in conflicts.items():
+            SESSION_WRITE_CONFLICTS.inc()
+            logger.warning(f"Session {session_id} was written by another process; reloading it")
+            redo = sorted(session_events + self._pending.pop(session_id, []), key=lambda e: e["seq"])
+            self._entries.pop(session_id, None)
+            self._unsnapshotted.discard(session_id)
+            try:
+                document = await self.get(session_id)
+            except Exception:
+                logger.exception(f"Could not reload session {session_id}; will retry")
+                # Written again next flush, conflicting again until the reload succeeds
+                self._pending[session_id] = redo + self._pending.get(session_id, [])
+                continue
+            for event in redo:
+                if not self._apply_decision(document, event["character_id"], event["insurance_option_id"]):
+                    logger.error(f"Dropped decision {event['_id']}: session {session_id} no longer accepts it")
+
+    async def snapshot(self):
+        """Write the sessions with new events back to ``game_states``."""
+        async with self._write_lock:
+            await self._snapshot()
+
+    async def _snapshot(self):
+        self._last_snapshot = time.monotonic()
+        # Sessions with unwritten events wait, so a snapshot never gets ahead of the log
+        due = [
+            session_id for session_id in self._unsnapshotted
+            if session_id not in self._pending and session_id in self._entries
+        ]
+        # Evicted or replaced sessions reload from the log, which has their events
+        self._unsnapshotted.intersection_update(self._entries)
+        if not due:
+            return
+        self._unsnapshotted.difference_update(due)
+        documents = [self._entries[session_id][0] for session_id in due]
+        seqs = [game_events.event_seq(document) for document in documents]
+        operations = [game_events.snapshot_update(document) for document in documents]
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception:
+            logger.exception(f"Failed to snapshot {len(operations)} sessions; will retry")
+            self._unsnapshotted.update(due)
+            return
+        for document, seq in zip(documents, seqs):
+            document["snapshot_seq"] = max(game_events.snapshot_seq(document), seq)
+
+    async def checkpoint(self):
+        """Write all pending events, then snapshot the sessions they changed."""
+        async with self._write_lock:
+            await self._flush()
+            await self._snapshot()
+
+    def _is_dirty(self, session_id: str) -> bool:
+        return (
+            session_id in self._pending
+            or session_id in self._in_flight
+            or session_id in self._unsnapshotted
+        )
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # Entries are in access order, so stop at the first recently used one
+        for session_id, (_, last_access) in list(self._entries.items()):
+            if last_access >= cutoff:
+                break
+            if not self._is_dirty(session_id):
+                del self._entries[session_id]
+
+    def _evict_overflow(self):
+        # Sessions with unflushed writes stay until the next flush
+        if len(self._entries) <= self.max_size:
+            return
+        for session_id in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            if not self._is_dirty(session_id):
+                del self._entries[session_id]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+                    await self.snapshot()
+                self.evict_idle()
+            except Exception:
+                # Keep the loop alive; pending writes stay queued for the next round
+                logger.exception("Session cache flush failed")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.checkpoint()
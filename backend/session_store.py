@@ -0,0 +1,455 @@
+"""Game session persistence.
+
+``SessionStore`` is what the route handlers depend on. ``MotorSessionStore``
+keeps sessions in MongoDB, as snapshots in ``game_states`` plus a log of
+decision events in ``game_events``, behind the write-behind ``SessionCache``;
+``MemorySessionStore`` keeps them in a dict for load tests and single-node
+demos. ``SESSION_STORE`` selects one ("mongo" by default, or "memory").
+
+With ``SESSION_CACHE=off`` the Motor store reads MongoDB on every request
+and records each decision with one atomic update of its snapshot, so any
+number of server processes can share the sessions. Switch modes after a
+clean shutdown, which writes every cached decision back.
+"""
+import asyncio
+import copy
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+import decision_stats
+import game_events
+from metrics import InstrumentedCollection
+from session_cache import SessionCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_TTL_SECONDS = 7 * 24 * 3600
+
+# Fields included when iterating sessions for export
+EXPORT_FIELDS = ("session_id", "created_at", "current_chapter", "characters", "completed_decisions")
+
+
+def watermark_filter(since: Optional[datetime], after_session_id: Optional[str]) -> dict:
+    """Mongo filter for sessions after the (created_at, session_id) watermark."""
+    if since is None:
+        return {}
+    if after_session_id is None:
+        return {"created_at": {"$gt": since}}
+    return {"$or": [
+        {"created_at": {"$gt": since}},
+        {"created_at": since, "session_id": {"$gt": after_session_id}},
+    ]}
+
+
+async def read_sessions(
+    states,
+    events,
+    since: Optional[datetime] = None,
+    after_session_id: Optional[str] = None,
+    batch_size: int = 500,
+) -> AsyncIterator[dict]:
+    """Stored sessions in export order, with the events newer than each snapshot applied.
+
+    Only reads: no indexes, cache or background tasks, so it is safe to run
+    from a separate process against a live database.
+    """
+    cursor = (
+        states.find(
+            watermark_filter(since, after_session_id),
+            projection={"_id": 0, "snapshot_seq": 1, **{field: 1 for field in EXPORT_FIELDS}},
+        )
+        .sort([("created_at", 1), ("session_id", 1)])
+        .batch_size(batch_size)
+    )
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            async for exported in _replayed(batch, events):
+                yield exported
+            batch = []
+    async for exported in _replayed(batch, events):
+        yield exported
+
+
+async def _replayed(documents: List[dict], events) -> AsyncIterator[dict]:
+    if not documents:
+        return
+    by_session = game_events.group_by_session(
+        await events.find(game_events.events_after_filter(documents)).to_list(None)
+    )
+    for document in documents:
+        game_events.replay(document, by_session.get(document["session_id"], []))
+        yield {field: document[field] for field in EXPORT_FIELDS if field in document}
+
+
+class SessionStore(ABC):
+    """Storage for ``GameState`` documents, keyed by ``session_id``."""
+
+    async def start(self):
+        """Prepare the store before serving requests."""
+
+    async def close(self):
+        """Flush pending writes and release resources."""
+
+    @abstractmethod
+    async def create(self, document: dict) -> dict:
+        """Insert a session unless one with the same session_id exists; return the stored one."""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def record_decision(self, session_id: str, character_id: str, insurance_option_id: str) -> bool:
+        """Set a character's plan; False if the session or character is unknown."""
+
+    async def record_decisions(self, decisions: List[Tuple[str, str, str]]) -> List[bool]:
+        """Apply (session_id, character_id, insurance_option_id) decisions in order.
+
+        Returns whether each one was recorded, as ``record_decision`` would.
+        """
+        return [await self.record_decision(*decision) for decision in decisions]
+
+    @abstractmethod
+    async def history(self, session_id: str) -> Optional[List[dict]]:
+        """The session's events in order, or None if the session is unknown."""
+
+    @abstractmethod
+    def iter_sessions(
+        self,
+        since: Optional[datetime] = None,
+        after_session_id: Optional[str] = None,
+        batch_size: int = 500,
+    ) -> AsyncIterator[dict]:
+        """Sessions ordered by (created_at, session_id), strictly after the given watermark.
+
+        Only ``EXPORT_FIELDS`` are returned.
+        """
+
+    @abstractmethod
+    async def decision_buckets(self, days: Optional[List[str]] = None) -> List[dict]:
+        """Decision counts per (day, character_id, age_band, insurance_option_id).
+
+        Restricted to sessions created on ``days`` (``YYYY-MM-DD``, UTC) when given.
+        """
+
+    @abstractmethod
+    async def decision_days_changed(self, since: datetime) -> List[str]:
+        """Creation days of sessions whose decisions changed at or after ``since``."""
+
+
+def mongo_client_options(environ=os.environ) -> dict:
+    """Motor connection pool settings from ``MONGO_*`` environment variables."""
+    return {
+        "maxPoolSize": int(environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        "minPoolSize": int(environ.get('MONGO_MIN_POOL_SIZE', '10')),
+        "maxIdleTimeMS": int(environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        "waitQueueTimeoutMS": int(environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+        "serverSelectionTimeoutMS": int(environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        "connectTimeoutMS": int(environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        "socketTimeoutMS": int(environ.get('MONGO_SOCKET_TIMEOUT_MS', '10000')),
+    }
+
+
+def session_cache_enabled(environ=os.environ) -> bool:
+    """Whether ``SESSION_CACHE`` ("on" by default, or "off") enables the write-behind cache."""
+    setting = environ.get('SESSION_CACHE', 'on').lower()
+    if setting not in ('on', 'off'):
+        raise ValueError(f"Unknown SESSION_CACHE {setting!r}; expected 'on' or 'off'")
+    return setting == 'on'
+
+
+def supports_multiple_workers(environ=os.environ) -> bool:
+    """Whether several server processes can share the configured session store."""
+    return environ.get('SESSION_STORE', 'mongo').lower() == 'mongo' and not session_cache_enabled(environ)
+
+
+class MotorSessionStore(SessionStore):
+    """Sessions in MongoDB.
+
+    The client is created in ``start()`` rather than here, so each server
+    worker opens its own connection pool on its own event loop. Without
+    ``cache`` every call goes to MongoDB.
+    """
+
+    def __init__(
+        self,
+        mongo_url: str,
+        db_name: str,
+        ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS,
+        cache_size: int = 10000,
+        cache_idle_seconds: float = 300.0,
+        flush_interval: float = 1.0,
+        snapshot_interval: float = 10.0,
+        miss_ttl: float = 0.0,
+        client_options: Optional[dict] = None,
+        cache: bool = True,
+    ):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.client_options = client_options or {}
+        self.client = None
+        self.db = None
+        self.game_states = None
+        self.game_events = None
+        self.ttl_seconds = ttl_seconds
+        self.cache: Optional[SessionCache] = None
+        if cache:
+            self.cache = SessionCache(
+                None,
+                max_size=cache_size,
+                idle_seconds=cache_idle_seconds,
+                flush_interval=flush_interval,
+                snapshot_interval=snapshot_interval,
+                miss_ttl=miss_ttl,
+            )
+
+    def connect(self):
+        self.client = AsyncIOMotorClient(self.mongo_url, **self.client_options)
+        self.db = self.client[self.db_name]
+        self.game_states = InstrumentedCollection(self.db.game_states)
+        self.game_events = InstrumentedCollection(self.db.game_events)
+        if self.cache is not None:
+            self.cache.collection = self.game_states
+            self.cache.events = self.game_events
+
+    async def ensure_ttl_index(self, collection):
+        """TTL index on created_at; an existing index with another expiry is updated in place."""
+        existing = (await collection.index_information()).get("created_at_ttl")
+        if existing and existing.get("expireAfterSeconds") != self.ttl_seconds:
+            await self.db.command(
+                "collMod", collection.name,
+                index={"name": "created_at_ttl", "expireAfterSeconds": self.ttl_seconds}
+            )
+        else:
+            await collection.create_index(
+                "created_at", expireAfterSeconds=self.ttl_seconds, name="created_at_ttl"
+            )
+
+    async def ensure_indexes(self):
+        collection = self.game_states
+        await collection.create_index("session_id", unique=True, name="session_id_unique")
+        await collection.create_index("updated_at", sparse=True, name="updated_at")
+        await self.ensure_ttl_index(collection)
+
+        await self.game_events.create_index([("session_id", 1), ("seq", 1)], name="session_seq")
+        await self.ensure_ttl_index(self.game_events)
+
+    async def start(self):
+        if self.client is None:
+            self.connect()
+        # Fail fast on an unreachable server and open the first pooled
+        # connection; the driver then fills the pool up to minPoolSize
+        await self.db.command("ping")
+        try:
+            await self.ensure_indexes()
+        except OperationFailure as e:
+            # e.g. duplicate session_ids left over from before the unique index existed
+            logger.error(f"Could not create game_states indexes: {e}")
+        if self.cache is not None:
+            self.cache.start()
+
+    async def close(self):
+        if self.cache is not None:
+            await self.cache.stop()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    async def create(self, document: dict) -> dict:
+        stored = await self.game_states.find_one_and_update(
+            {"session_id": document["session_id"]},
+            {"$setOnInsert": document},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if stored["id"] != document["id"]:
+            # Already started: the cached copy, or its snapshot with the later events
+            return await self.get(document["session_id"])
+        if self.cache is not None:
+            self.cache.put(stored)
+        return stored
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        if self.cache is not None:
+            return await self.cache.get(session_id)
+        document = await self.game_states.find_one({"session_id": session_id})
+        if document:
+            events = await self.game_events.find(
+                {"session_id": session_id, "seq": {"$gt": game_events.snapshot_seq(document)}}
+            ).to_list(None)
+            game_events.replay(document, events)
+        return document
+
+    async def record_decision(self, session_id: str, character_id: str, insurance_option_id: str) -> bool:
+        if self.cache is not None:
+            return await self.cache.record_decision(session_id, character_id, insurance_option_id)
+        # One atomic write sets the choice and numbers the event; the snapshot
+        # then includes it, so readers never need to replay it
+        stored = await self.game_states.find_one_and_update(
+            {"session_id": session_id, "characters.id": character_id},
+            {
+                "$set": {
+                    "characters.$.insurance_choice": insurance_option_id,
+                    f"completed_decisions.{character_id}": insurance_option_id,
+                },
+                "$inc": {"snapshot_seq": 1},
+                "$currentDate": {"updated_at": True},
+            },
+            projection={"snapshot_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if stored is None:
+            return False
+        await self.game_events.insert_one(
+            game_events.decision_event(session_id, stored["snapshot_seq"], character_id, insurance_option_id)
+        )
+        return True
+
+    async def record_decisions(self, decisions):
+        if self.cache is not None:
+            return await self.cache.record_decisions(decisions)
+        return await super().record_decisions(decisions)
+
+    async def history(self, session_id):
+        if await self.get(session_id) is None:
+            return None
+        if self.cache is not None:
+            await self.cache.flush()
+        cursor = self.game_events.find({"session_id": session_id}, projection={"_id": 0}).sort("seq", 1)
+        return await cursor.to_list(None)
+
+    async def iter_sessions(self, since=None, after_session_id=None, batch_size=500):
+        if self.cache is not None:
+            # Make recent decisions visible to the export
+            await self.cache.checkpoint()
+        async for document in read_sessions(self.game_states, self.game_events, since, after_session_id, batch_size):
+            yield document
+
+    async def decision_buckets(self, days=None):
+        match = decision_stats.day_range_filter(days) if days is not None else {}
+        cursor = self.game_states.aggregate(decision_stats.bucket_pipeline(match))
+        return [{**row["_id"], "count": row["count"]} async for row in cursor]
+
+    async def decision_days_changed(self, since):
+        cursor = self.game_states.aggregate(decision_stats.changed_days_pipeline(since))
+        return [row["_id"] async for row in cursor]
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store; sessions expire ``ttl_seconds`` after creation."""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_SESSION_TTL_SECONDS, purge_interval: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self._sessions: Dict[str, dict] = {}
+        self._events: Dict[str, List[dict]] = {}
+        self._purge_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def purge_expired(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        for session_id, document in list(self._sessions.items()):
+            if document["created_at"] < cutoff:
+                del self._sessions[session_id]
+                self._events.pop(session_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            self.purge_expired()
+
+    async def start(self):
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+
+    async def create(self, document: dict) -> dict:
+        return self._sessions.setdefault(document["session_id"], copy.deepcopy(document))
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        return self._sessions.get(session_id)
+
+    async def record_decision(self, session_id: str, character_id: str, insurance_option_id: str) -> bool:
+        document = self._sessions.get(session_id)
+        if not document or not game_events.apply_decision(document, character_id, insurance_option_id):
+            return False
+        document["updated_at"] = datetime.utcnow()
+        events = self._events.setdefault(session_id, [])
+        events.append(game_events.decision_event(session_id, len(events) + 1, character_id, insurance_option_id))
+        return True
+
+    async def history(self, session_id):
+        if session_id not in self._sessions:
+            return None
+        return [
+            {key: value for key, value in event.items() if key != "_id"}
+            for event in self._events.get(session_id, [])
+        ]
+
+    async def iter_sessions(self, since=None, after_session_id=None, batch_size=500):
+        documents = sorted(self._sessions.values(), key=lambda d: (d["created_at"], d["session_id"]))
+        for document in documents:
+            if since is not None:
+                if document["created_at"] < since:
+                    continue
+                if document["created_at"] == since and (
+                    after_session_id is None or document["session_id"] <= after_session_id
+                ):
+                    continue
+            yield {field: copy.deepcopy(document[field]) for field in EXPORT_FIELDS}
+
+    async def decision_buckets(self, days=None):
+        documents = self._sessions.values()
+        if days is not None:
+            days = set(days)
+            documents = [d for d in documents if d["created_at"].strftime(decision_stats.DAY_FORMAT) in days]
+        return decision_stats.session_buckets(documents)
+
+    async def decision_days_changed(self, since):
+        return sorted({
+            d["created_at"].strftime(decision_stats.DAY_FORMAT)
+            for d in self._sessions.values()
+            if d.get("updated_at") and d["updated_at"] >= since
+        })
+
+
+def create_session_store(environ=os.environ) -> SessionStore:
+    """Build the store selected by ``SESSION_STORE`` from environment settings."""
+    backend = environ.get('SESSION_STORE', 'mongo').lower()
+    ttl_seconds = int(environ.get('SESSION_TTL_SECONDS', str(DEFAULT_SESSION_TTL_SECONDS)))
+
+    if backend == 'memory':
+        return MemorySessionStore(ttl_seconds=ttl_seconds)
+    if backend == 'mongo':
+        return MotorSessionStore(
+            environ['MONGO_URL'],
+            environ['DB_NAME'],
+            ttl_seconds=ttl_seconds,
+            cache_size=int(environ.get('SESSION_CACHE_SIZE', '10000')),
+            cache_idle_seconds=float(environ.get('SESSION_CACHE_IDLE_SECONDS', '300')),
+            flush_interval=float(environ.get('SESSION_CACHE_FLUSH_SECONDS', '1.0')),
+            snapshot_interval=float(environ.get('SESSION_SNAPSHOT_SECONDS', '10')),
+            miss_ttl=float(environ.get('SESSION_CACHE_MISS_SECONDS', '0')),
+            client_options=mongo_client_options(environ),
+            cache=session_cache_enabled(environ),
+        )
+    raise ValueError(f"Unknown SESSION_STORE {backend!r}; expected 'mongo' or 'memory'")
@@ -0,0 +1,152 @@
+"""Monte Carlo simulation of annual out-of-pocket cost per insurance plan.
+
+Each simulated year draws every scenario independently with a probability
+derived from its ``age_relevance`` and the character's age. The year's
+treatment costs are summed, then the plan's deductible (once per year),
+copayment and coverage limit are applied to the annual total.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+import outcome_engine
+
+# Annual probability of a scenario for a character at REFERENCE_AGE
+RELEVANCE_BASE_PROBABILITY = {"high": 0.08, "medium": 0.03, "low": 0.01}
+# Yearly growth of that probability past REFERENCE_AGE; conditions that are
+# atypical for young adults become more likely as characters get older
+RELEVANCE_AGE_GROWTH = {"high": 0.0, "medium": 0.04, "low": 0.06}
+REFERENCE_AGE = 25
+MAX_EVENT_PROBABILITY = 0.95
+
+# Cells of the (years x scenarios) event matrix drawn per chunk; with the
+# float32 draws, the event mask and its float32 copy that is about 36 MB
+CHUNK_CELLS = 4_000_000
+PERCENTILES = (50, 95, 99)
+
+
+def event_probabilities(scenarios: Sequence, age: int) -> np.ndarray:
+    """Annual probability of each scenario for a character of the given age."""
+    base = np.array([RELEVANCE_BASE_PROBABILITY[s.age_relevance] for s in scenarios])
+    growth = np.array([RELEVANCE_AGE_GROWTH[s.age_relevance] for s in scenarios])
+    years_past_reference = max(0, age - REFERENCE_AGE)
+    return np.minimum(base * (1 + growth) ** years_past_reference, MAX_EVENT_PROBABILITY)
+
+
+def simulate_annual_costs(
+    treatment_costs: np.ndarray,
+    probabilities: np.ndarray,
+    years: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """Total treatment cost incurred in each of ``years`` simulated years."""
+    totals = np.empty(years, dtype=np.float64)
+    costs = np.asarray(treatment_costs, dtype=np.float32)
+    chunk_years = max(1, CHUNK_CELLS // max(1, len(probabilities)))
+    for start in range(0, years, chunk_years):
+        stop = min(start + chunk_years, years)
+        events = rng.random((stop - start, len(probabilities)), dtype=np.float32) < probabilities
+        # float32 product; a float64 one would double the matrix it converts to
+        totals[start:stop] = events.astype(np.float32) @ costs
+    return totals
+
+
+def plan_out_of_pocket(annual_costs: np.ndarray, plans: Sequence) -> np.ndarray:
+    """Out-of-pocket cost per (plan, year) for the given annual treatment totals."""
+    columns = outcome_engine.plan_arrays(plans)
+    return outcome_engine.total_out_of_pocket(
+        annual_costs[np.newaxis, :],
+        columns["annual_deductible"][:, np.newaxis],
+        columns["copayment_percentage"][:, np.newaxis] / 100,
+        columns["coverage_limit"][:, np.newaxis],
+    )
+
+
+def summarize(out_of_pocket: np.ndarray, annual_premium: float) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(out_of_pocket, PERCENTILES)
+    mean = float(out_of_pocket.mean())
+    return {
+        "mean_out_of_pocket": mean,
+        "p50_out_of_pocket": float(p50),
+        "p95_out_of_pocket": float(p95),
+        "p99_out_of_pocket": float(p99),
+        "annual_premium": annual_premium,
+        "mean_total_cost": mean + annual_premium,
+        "p95_total_cost": float(p95) + annual_premium,
+    }
+
+
+def simulate(
+    characters: Sequence,
+    plans: Sequence,
+    scenarios: Sequence,
+    years: int,
+    seed: Optional[int] = None,
+) -> Dict[str, dict]:
+    """Annual cost distributions for every character under every plan.
+
+    Each character gets an independent random stream spawned from ``seed``.
+    """
+    treatment_costs = np.array([s.treatment_cost for s in scenarios], dtype=np.float64)
+    streams = np.random.SeedSequence(seed).spawn(len(characters))
+
+    results = {}
+    for character, stream in zip(characters, streams):
+        probabilities = event_probabilities(scenarios, character.age)
+        annual_costs = simulate_annual_costs(treatment_costs, probabilities, years, np.random.default_rng(stream))
+        out_of_pocket = plan_out_of_pocket(annual_costs, plans)
+        results[character.id] = {
+            "character_name": character.name,
+            "age": character.age,
+            "expected_events_per_year": float(probabilities.sum()),
+            "mean_treatment_cost": float(annual_costs.mean()),
+            "plans": {
+                plan.id: summarize(out_of_pocket[i], plan.monthly_premium * 12)
+                for i, plan in enumerate(plans)
+            },
+        }
+    return results
+
+
+def project_year(
+    cohort: Sequence[dict],
+    plans: Sequence,
+    scenarios: Sequence,
+    year_index: int,
+    paths: int,
+    seed: int,
+) -> dict:
+    """One year of a multi-year cohort projection.
+
+    ``cohort`` entries have ``id``, ``age`` (at the start of the projection)
+    and ``count``. Every member is ``year_index`` years older than at the
+    start, which shifts their scenario probabilities. The random stream
+    depends only on ``seed`` and ``year_index``, so a year computed again
+    after a restart gives the same numbers.
+    """
+    treatment_costs = np.array([s.treatment_cost for s in scenarios], dtype=np.float64)
+    streams = np.random.SeedSequence([seed, year_index]).spawn(len(cohort))
+
+    members = {}
+    cohort_totals = {plan.id: {"expected_out_of_pocket": 0.0, "premiums": 0.0} for plan in plans}
+    for member, stream in zip(cohort, streams):
+        age = member["age"] + year_index
+        probabilities = event_probabilities(scenarios, age)
+        annual_costs = simulate_annual_costs(treatment_costs, probabilities, paths, np.random.default_rng(stream))
+        out_of_pocket = plan_out_of_pocket(annual_costs, plans)
+        member_plans = {}
+        for i, plan in enumerate(plans):
+            mean = float(out_of_pocket[i].mean())
+            annual_premium = plan.monthly_premium * 12
+            member_plans[plan.id] = {
+                "mean_out_of_pocket": mean,
+                "p95_out_of_pocket": float(np.percentile(out_of_pocket[i], 95)),
+                "annual_premium": annual_premium,
+            }
+            cohort_totals[plan.id]["expected_out_of_pocket"] += mean * member["count"]
+            cohort_totals[plan.id]["premiums"] += annual_premium * member["count"]
+        members[member["id"]] = {"age": age, "count": member["count"], "plans": member_plans}
+
+    for totals in cohort_totals.values():
+        totals["expected_total_cost"] = totals["expected_out_of_pocket"] + totals["premiums"]
+    return {"year": year_index + 1, "members": members, "cohort": cohort_totals}
@@ -1,6 +1,7 @@
 import requests
 import unittest
 import uuid
+import time
 import json
 import os
 from dotenv import load_dotenv
@@ -408,7 +409,7 @@ class TestMediShieldStoryGameAPI(unittest.TestCase):
         )
         # Try invalid decision
         response = requests.post(f"{API_URL}/game/decision", json=invalid_decision)
-        self.assertEqual(response.status_code, 200)  # API accepts but character won't be found
+        self.assertEqual(response.status_code, 404)
         
         # Verify decision wasn't recorded for nonexistent character
         response = requests.get(f"{API_URL}/game/{self.session_id}")
@@ -416,7 +417,361 @@ class TestMediShieldStoryGameAPI(unittest.TestCase):
         data = response.json()
         self.assertNotIn("nonexistent_character", data["completed_decisions"])
         
+        # Test decision for a session that does not exist
+        response = requests.post(f"{API_URL}/game/decision", json={
+            "session_id": str(uuid.uuid4()),
+            "decision": {"character_id": "alex", "insurance_option_id": "medishield_basic"}
+        })
+        self.assertEqual(response.status_code, 404)
+        
         print("✅ Error handling passed")
+        
+    def test_12_batch_outcome_calculation(self):
+        """Test batch outcome calculation across plans and scenarios"""
+        # Create a new game session with decisions
+        self.test_06_decision_making_system()
+        
+        response = requests.post(
+            f"{API_URL}/game/calculate-outcomes",
+            json={"session_id": self.session_id, "scenario_ids": ["appendix_surgery", "broken_arm"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s["id"] for s in data["scenarios"]], ["appendix_surgery", "broken_arm"])
+        
+        # Every character gets a result for every plan
+        alex = data["outcomes"]["appendix_surgery"]["alex"]
+        self.assertEqual(alex["insurance_choice"], "medishield_basic")
+        self.assertAlmostEqual(alex["plans"]["medishield_basic"]["out_of_pocket_cost"], 5200.0, places=1)
+        # The breakdown adds up to the out-of-pocket total
+        medishield = alex["plans"]["medishield_basic"]
+        self.assertAlmostEqual(medishield["deductible_cost"], 3000.0, places=1)
+        self.assertAlmostEqual(medishield["copayment_cost"], 2200.0, places=1)
+        self.assertAlmostEqual(medishield["excess_cost"], 0.0, places=1)
+        self.assertAlmostEqual(alex["plans"]["integrated_shield"]["out_of_pocket_cost"], 2200.0, places=1)
+        
+        jamie = data["outcomes"]["broken_arm"]["jamie"]
+        self.assertAlmostEqual(jamie["plans"]["integrated_shield"]["out_of_pocket_cost"], 1700.0, places=1)
+        self.assertEqual(jamie["plans"]["integrated_shield"]["financial_impact"], "Low")
+        
+        # Unknown scenario IDs are rejected
+        response = requests.post(
+            f"{API_URL}/game/calculate-outcomes",
+            json={"scenario_ids": ["nonexistent_scenario"]}
+        )
+        self.assertEqual(response.status_code, 404)
+        
+        print("✅ Batch outcome calculation passed")
+        
+    def test_13_filtered_scenarios(self):
+        """Test scenario filtering and lookup by ID"""
+        response = requests.get(f"{API_URL}/scenarios", params={"category": "emergency", "urgency": "high"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(len(data) > 0)
+        for scenario in data:
+            self.assertEqual(scenario["category"], "emergency")
+            self.assertEqual(scenario["urgency_level"], "high")
+        
+        # Lookup a single scenario
+        response = requests.get(f"{API_URL}/scenarios/broken_arm")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["treatment_cost"], 15000.0)
+        
+        response = requests.get(f"{API_URL}/scenarios/nonexistent_scenario")
+        self.assertEqual(response.status_code, 404)
+        
+        print("✅ Filtered scenarios passed")
+        
+    def test_14_catalog_etag_revalidation(self):
+        """Test ETag and If-None-Match handling on catalog endpoints"""
+        for path in ["insurance-options", "characters", "scenarios", "stats/comparison"]:
+            response = requests.get(f"{API_URL}/{path}")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers.get("ETag")
+            self.assertIsNotNone(etag)
+            self.assertIn("max-age", response.headers.get("Cache-Control", ""))
+            
+            # Revalidating with the same ETag returns 304 and no body
+            response = requests.get(f"{API_URL}/{path}", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+        
+        print("✅ Catalog ETag revalidation passed")
+        
+    def test_15_bootstrap(self):
+        """Test the bootstrap endpoint returns catalog data and starts a session"""
+        response = requests.post(f"{API_URL}/bootstrap", json={"session_id": self.session_id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["characters"]), 2)
+        self.assertEqual(len(data["insurance_options"]), 2)
+        self.assertTrue(len(data["scenarios"]) > 0)
+        self.assertIn("cost_difference", data["comparison"])
+        self.assertEqual(data["game_state"]["session_id"], self.session_id)
+        self.assertEqual(data["game_state"]["completed_decisions"], {})
+        
+        # The session is persisted
+        response = requests.get(f"{API_URL}/game/{self.session_id}")
+        self.assertEqual(response.status_code, 200)
+        
+        print("✅ Bootstrap passed")
+        
+    def test_16_idempotent_game_start(self):
+        """Test that starting the same session twice keeps the existing state"""
+        response = requests.post(f"{API_URL}/game/start", json={"session_id": self.session_id})
+        self.assertEqual(response.status_code, 200)
+        first_id = response.json()["id"]
+        
+        requests.post(f"{API_URL}/game/decision", json={
+            "session_id": self.session_id,
+            "decision": {"character_id": "alex", "insurance_option_id": "medishield_basic"}
+        })
+        
+        response = requests.post(f"{API_URL}/game/start", json={"session_id": self.session_id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["id"], first_id)
+        self.assertEqual(data["completed_decisions"]["alex"], "medishield_basic")
+        
+        print("✅ Idempotent game start passed")
+        
+    def test_17_annual_cost_simulation(self):
+        """Test the Monte Carlo annual cost simulation"""
+        request = {"years": 10000, "seed": 42}
+        response = requests.post(f"{API_URL}/simulate", json=request)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["years"], 10000)
+        self.assertEqual(data["seed"], 42)
+        
+        for character_id in ["alex", "jamie"]:
+            plans = data["results"][character_id]["plans"]
+            for plan_id in ["medishield_basic", "integrated_shield"]:
+                stats = plans[plan_id]
+                self.assertLessEqual(stats["p50_out_of_pocket"], stats["p95_out_of_pocket"])
+                self.assertLessEqual(stats["p95_out_of_pocket"], stats["p99_out_of_pocket"])
+            self.assertEqual(plans["medishield_basic"]["annual_premium"], 1800.0)
+            self.assertEqual(plans["integrated_shield"]["annual_premium"], 5400.0)
+        
+        # The same seed reproduces the same results
+        response = requests.post(f"{API_URL}/simulate", json=request)
+        self.assertEqual(response.json(), data)
+        
+        print("✅ Annual cost simulation passed")
+        
+    def test_18_admin_export(self):
+        """Test the streaming session export"""
+        admin_token = os.environ.get('ADMIN_TOKEN')
+        if not admin_token:
+            self.skipTest("ADMIN_TOKEN not set")
+        headers = {"X-Admin-Token": admin_token}
+        
+        requests.post(f"{API_URL}/game/start", json={"session_id": self.session_id})
+        response = requests.get(f"{API_URL}/admin/export", params={"format": "ndjson"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        sessions = [json.loads(line) for line in response.text.splitlines()]
+        self.assertIn(self.session_id, [s["session_id"] for s in sessions])
+        
+        # Resuming after the last line returns nothing new
+        last = sessions[-1]
+        response = requests.get(f"{API_URL}/admin/export", headers=headers, params={
+            "since": last["created_at"], "after_session_id": last["session_id"]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "")
+        
+        # Wrong token is rejected
+        response = requests.get(f"{API_URL}/admin/export", headers={"X-Admin-Token": "wrong"})
+        self.assertEqual(response.status_code, 401)
+        
+        print("✅ Admin export passed")
+        
+    def test_19_decision_stats(self):
+        """Test aggregated plan-choice analytics"""
+        response = requests.get(f"{API_URL}/stats/decisions")
+        self.assertEqual(response.status_code, 200)
+        
+        data = response.json()
+        for key in ["generated_at", "total_decisions", "per_character", "per_age_band", "over_time"]:
+            self.assertIn(key, data)
+        for stats in data["per_character"].values():
+            self.assertEqual(stats["total"], sum(p["count"] for p in stats["plans"].values()))
+        
+        print("✅ Decision stats passed")
+        
+    def test_20_bulk_decisions(self):
+        """Test submitting decisions for several sessions at once"""
+        other_session_id = f"{self.session_id}_b"
+        for session_id in [self.session_id, other_session_id]:
+            requests.post(f"{API_URL}/game/start", json={"session_id": session_id})
+        
+        response = requests.post(f"{API_URL}/game/decisions", json={"decisions": [
+            {"session_id": self.session_id, "decision": {"character_id": "alex", "insurance_option_id": "medishield_basic"}},
+            {"session_id": other_session_id, "decision": {"character_id": "jamie", "insurance_option_id": "integrated_shield"}},
+            {"session_id": other_session_id, "decision": {"character_id": "unknown", "insurance_option_id": "integrated_shield"}},
+            {"session_id": "no_such_session", "decision": {"character_id": "alex", "insurance_option_id": "medishield_basic"}},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        
+        data = response.json()
+        self.assertEqual(data["recorded"], 2)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual([r["status"] for r in data["results"]], [200, 200, 404, 404])
+        
+        game_state = requests.get(f"{API_URL}/game/{other_session_id}").json()
+        self.assertEqual(game_state["completed_decisions"], {"jamie": "integrated_shield"})
+        
+        print("✅ Bulk decisions passed")
+        
+    def test_21_plan_optimizer(self):
+        """Test the plan-design Pareto search"""
+        response = requests.post(f"{API_URL}/plans/optimize", json={
+            "character_id": "alex",
+            "annual_deductible": {"min": 0, "max": 5000, "steps": 11},
+            "copayment_percentage": {"min": 0, "max": 20, "steps": 5},
+            "coverage_limit": {"min": 100000, "max": 1000000, "steps": 10}
+        })
+        self.assertEqual(response.status_code, 200)
+        
+        data = response.json()
+        self.assertEqual(data["candidates"], 11 * 5 * 10)
+        front = data["pareto_front"]
+        self.assertGreater(len(front), 0)
+        # Sorted by premium, each step buys a lower expected out-of-pocket cost
+        for cheaper, dearer in zip(front, front[1:]):
+            self.assertLessEqual(cheaper["annual_premium"], dearer["annual_premium"])
+            self.assertGreater(cheaper["expected_out_of_pocket"], dearer["expected_out_of_pocket"])
+        self.assertEqual(len(data["catalog_plans"]), 2)
+        
+        # Premiums carry a risk charge on top of the loaded expected claims, so
+        # the expected cost to the insurer plus the member differs between designs
+        def expected_costs(points):
+            return {round(p["annual_premium"] / 1.25 + p["expected_out_of_pocket"], 2) for p in points}
+        self.assertGreater(len(expected_costs(front)), 1)
+        # Without it every candidate would lie on one line
+        response = requests.post(f"{API_URL}/plans/optimize", json={"character_id": "alex", "risk_loading": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(expected_costs(response.json()["pareto_front"])), 1)
+        
+        print("✅ Plan optimizer passed")
+
+    def test_22_projection_job(self):
+        """Test a background cohort projection job"""
+        response = requests.post(f"{API_URL}/jobs/projection", json={
+            "cohort": [{"id": "alex", "age": 25, "count": 100}],
+            "years": 3,
+            "paths": 1000,
+            "seed": 11
+        })
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        
+        for _ in range(60):
+            job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+            if job["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.5)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["progress"]["completed"], 3)
+        self.assertEqual(len(job["summary"]), 2)
+        # Polls carry the summary only; results are paged by year
+        self.assertNotIn("results", job)
+        
+        page = requests.get(f"{API_URL}/jobs/{job_id}", params={"include_results": 1, "limit": 2}).json()
+        self.assertEqual([result["year"] for result in page["results"]], [1, 2])
+        self.assertEqual(page["next_from_year"], 3)
+        page = requests.get(f"{API_URL}/jobs/{job_id}", params={"include_results": 1, "from_year": 3}).json()
+        self.assertEqual([result["year"] for result in page["results"]], [3])
+        self.assertEqual(page["results"][0]["members"]["alex"]["age"], 27)
+        self.assertIsNone(page["next_from_year"])
+        
+        response = requests.get(f"{API_URL}/jobs/missing")
+        self.assertEqual(response.status_code, 404)
+        
+        print("✅ Projection job passed")
+
+    def test_23_decision_history(self):
+        """Test that decisions are kept as an ordered history"""
+        session_id = f"history-{uuid.uuid4()}"
+        requests.post(f"{API_URL}/game/start", json={"session_id": session_id})
+        for option_id in ("medishield_basic", "integrated_shield"):
+            requests.post(f"{API_URL}/game/decision", json={
+                "session_id": session_id,
+                "decision": {"character_id": "alex", "insurance_option_id": option_id}
+            })
+        
+        response = requests.get(f"{API_URL}/game/{session_id}/history")
+        self.assertEqual(response.status_code, 200)
+        events = response.json()["events"]
+        self.assertEqual([event["seq"] for event in events], [1, 2])
+        self.assertEqual(events[-1]["insurance_option_id"], "integrated_shield")
+        
+        # The session reflects the latest decision
+        game_state = requests.get(f"{API_URL}/game/{session_id}").json()
+        self.assertEqual(game_state["completed_decisions"]["alex"], "integrated_shield")
+        
+        response = requests.get(f"{API_URL}/game/missing-{uuid.uuid4()}/history")
+        self.assertEqual(response.status_code, 404)
+        
+        print("✅ Decision history passed")
+
+    def test_24_compression(self):
+        """Test gzip responses and their ETags"""
+        response = requests.get(f"{API_URL}/scenarios", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertIn("Accept-Encoding", response.headers.get("Vary", ""))
+        self.assertGreater(len(response.json()), 0)
+        
+        # Compressed and uncompressed bodies have distinct ETags
+        identity = requests.get(f"{API_URL}/scenarios", headers={"Accept-Encoding": "identity"})
+        self.assertIsNone(identity.headers.get("Content-Encoding"))
+        self.assertNotEqual(identity.headers["ETag"], response.headers["ETag"])
+        self.assertEqual(identity.json(), response.json())
+        
+        response = requests.get(f"{API_URL}/scenarios", headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": response.headers["ETag"]
+        })
+        self.assertEqual(response.status_code, 304)
+        
+        # The precompressed catalog and the new session arrive as one gzip body
+        session_id = f"gzip-{uuid.uuid4()}"
+        response = requests.post(f"{API_URL}/bootstrap", json={"session_id": session_id},
+                                 headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.json()["game_state"]["session_id"], session_id)
+        self.assertEqual(len(response.json()["characters"]), 2)
+        
+        print("✅ Compression passed")
+        
+    def test_25_metrics_and_server_timing(self):
+        """Test the Prometheus metrics endpoint and the Server-Timing header"""
+        response = requests.post(f"{API_URL}/game/start", json={"session_id": self.session_id})
+        self.assertEqual(response.status_code, 200)
+        
+        # Every response carries a phase breakdown
+        response = requests.get(f"{API_URL}/game/{self.session_id}")
+        self.assertEqual(response.status_code, 200)
+        server_timing = response.headers.get("Server-Timing", "")
+        for phase in ("validation", "db", "compute", "serialization", "total"):
+            self.assertIn(f"{phase};dur=", server_timing)
+        
+        response = requests.get(f"{BACKEND_URL}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        body = response.text
+        self.assertIn("# TYPE http_requests_total counter", body)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        # Requests are labelled by route template, not by the raw path
+        self.assertIn('http_requests_total{method="GET",route="/api/game/{session_id}",status="200"}', body)
+        self.assertNotIn(self.session_id, body)
+        self.assertIn('mongo_operation_duration_seconds_count{collection="game_states"', body)
+        self.assertIn("http_requests_in_progress", body)
+        
+        print("✅ Metrics and Server-Timing passed")
 
 
 if __name__ == "__main__":
@@ -36,21 +36,14 @@ function App() {
     try {
       setLoading(true);
       
-      // Fetch game data
-      const [charactersRes, insuranceRes, scenariosRes, comparisonRes] = await Promise.all([
-        axios.get(`${API}/characters`),
-        axios.get(`${API}/insurance-options`),
-        axios.get(`${API}/scenarios`),
-        axios.get(`${API}/stats/comparison`)
-      ]);
+      // Fetch game data and start the session in one round-trip
+      const response = await axios.post(`${API}/bootstrap`, { session_id: sessionId });
 
-      setCharacters(charactersRes.data);
-      setInsuranceOptions(insuranceRes.data);
-      setScenarios(scenariosRes.data);
-      setComparisonData(comparisonRes.data);
-
-      // Start game session
-      await axios.post(`${API}/game/start`, { session_id: sessionId });
+      setCharacters(response.data.characters);
+      setInsuranceOptions(response.data.insurance_options);
+      setScenarios(response.data.scenarios);
+      setComparisonData(response.data.comparison);
+      setGameState(response.data.game_state);
       
       setLoading(false);
     } catch (error) {
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend is a directory of flat modules (run as server:app from backend/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
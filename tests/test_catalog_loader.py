@@ -0,0 +1,113 @@
+import asyncio
+import copy
+import unittest
+
+from catalog_loader import DEFAULT_CATALOG_PATH, CatalogWatcher, catalog_version, parse_catalog, read_catalog_file
+from response_cache import ResponseCache
+
+
+class StubCatalogSource:
+    """Catalog source returning the given documents one load at a time."""
+
+    def __init__(self, *documents):
+        self.documents = list(documents)
+
+    async def load(self):
+        return self.documents.pop(0) if self.documents else None
+
+    async def close(self):
+        pass
+
+
+class TestCatalogLoader(unittest.TestCase):
+    """Catalog validation and hot reload"""
+
+    def setUp(self):
+        self.data = read_catalog_file(DEFAULT_CATALOG_PATH)
+
+    def test_01_valid_catalog(self):
+        """Test that the bundled catalog validates into the models"""
+        catalog = parse_catalog(self.data)
+        self.assertEqual(catalog.version, catalog_version(self.data))
+        self.assertGreaterEqual(len(catalog.insurance_options), 2)
+        self.assertIn("medishield_basic", catalog.insurance_options_by_id)
+        self.assertIn("broken_arm", catalog.scenarios_by_id)
+
+    def test_02_invalid_catalogs(self):
+        """Test that incomplete or inconsistent catalogs are rejected"""
+        data = copy.deepcopy(self.data)
+        data["scenarios"].append(dict(data["scenarios"][0]))
+        with self.assertRaisesRegex(ValueError, "duplicate ids in 'scenarios'"):
+            parse_catalog(data)
+
+        data = copy.deepcopy(self.data)
+        data["insurance_options"] = data["insurance_options"][:1]
+        with self.assertRaisesRegex(ValueError, "at least two insurance options"):
+            parse_catalog(data)
+
+        data = copy.deepcopy(self.data)
+        data["characters"] = []
+        with self.assertRaisesRegex(ValueError, "non-empty 'characters'"):
+            parse_catalog(data)
+
+        # Model validation errors are ValueErrors too
+        data = copy.deepcopy(self.data)
+        del data["insurance_options"][0]["monthly_premium"]
+        with self.assertRaises(ValueError):
+            parse_catalog(data)
+
+    def test_03_reload_keeps_current_version_on_invalid_data(self):
+        """Test that the watcher only applies new, valid catalogs"""
+        invalid = copy.deepcopy(self.data)
+        invalid["insurance_options"] = invalid["insurance_options"][:1]
+        updated = copy.deepcopy(self.data)
+        updated["insurance_options"][0]["monthly_premium"] += 10
+        applied = []
+
+        async def on_change(catalog):
+            applied.append(catalog)
+
+        async def run():
+            source = StubCatalogSource(self.data, invalid, copy.deepcopy(self.data), updated)
+            watcher = CatalogWatcher(source, on_change, poll_interval=0)
+            await watcher.start()
+            self.assertEqual(watcher.version, catalog_version(self.data))
+
+            # Invalid data is skipped and the current version stays
+            self.assertFalse(await watcher.check())
+            self.assertEqual(watcher.version, catalog_version(self.data))
+            # Unchanged data is not applied again
+            self.assertFalse(await watcher.check())
+
+            self.assertTrue(await watcher.check())
+            self.assertEqual(watcher.version, catalog_version(updated))
+            await watcher.stop()
+
+        asyncio.run(run())
+        self.assertEqual(len(applied), 2)
+        self.assertEqual(
+            applied[1].insurance_options[0].monthly_premium,
+            self.data["insurance_options"][0]["monthly_premium"] + 10
+        )
+
+    def test_04_response_cache_swap(self):
+        """Test that cached responses switch versions all at once"""
+        cache = ResponseCache()
+        cache.replace({"characters": ["old"], "scenarios": ["old"]})
+        old_etag = cache.get("characters").etag
+
+        # Building the next version leaves the live entries alone
+        entries = cache.build_entries({"characters": ["new"], "bootstrap": ["new"]})
+        self.assertEqual(cache.get("characters").etag, old_etag)
+        self.assertIsNone(cache.get("bootstrap"))
+
+        cache.swap(entries)
+        self.assertEqual(cache.get("characters").body, b'["new"]')
+        self.assertNotEqual(cache.get("characters").etag, old_etag)
+        self.assertEqual(cache.get("bootstrap").body, b'["new"]')
+        self.assertIsNone(cache.get("scenarios"))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import gzip
+import zlib
+import unittest
+
+from compression import GzipPrefix, negotiate
+
+
+class TestNegotiate(unittest.TestCase):
+    """Accept-Encoding negotiation"""
+
+    def test_01_preference(self):
+        self.assertEqual(negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(negotiate("gzip;q=0, identity"), None)
+        self.assertEqual(negotiate("br, gzip", ("gzip",)), "gzip")
+        self.assertIsNone(negotiate(None))
+
+
+class TestGzipPrefix(unittest.TestCase):
+    """Gzip bodies completed from a precompressed prefix"""
+
+    def test_01_single_member(self):
+        """Test that each completed body is one gzip member holding prefix plus suffix"""
+        prefix = b'{"catalog":' + b'"abcdefgh",' * 500 + b'"game_state":'
+        gzip_prefix = GzipPrefix(prefix)
+        for suffix in (b'{"session_id":"a"}}', b'{"session_id":"b"}}'):
+            body = gzip_prefix.complete(suffix)
+            self.assertTrue(body.startswith(gzip_prefix.head))
+            self.assertEqual(gzip.decompress(body), prefix + suffix)
+            # Decoders that stop after the first member still see everything
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.assertEqual(decoder.decompress(body), prefix + suffix)
+            self.assertEqual(decoder.unused_data, b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
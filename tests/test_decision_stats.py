@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+
+from decision_stats import DecisionStats
+from session_store import MemorySessionStore
+
+
+def stored_session(session_id, updated_at, **decisions):
+    return {
+        "session_id": session_id,
+        "created_at": datetime.utcnow(),
+        "updated_at": updated_at,
+        "characters": [{"id": "alex", "age": 28}],
+        "completed_decisions": decisions,
+    }
+
+
+class CountingStore(MemorySessionStore):
+    def __init__(self):
+        super().__init__()
+        self.full_scans = 0
+
+    async def decision_buckets(self, days=None):
+        if days is None:
+            self.full_scans += 1
+        await asyncio.sleep(0.01)
+        return await super().decision_buckets(days)
+
+
+class TestDecisionStats(unittest.TestCase):
+    """Incremental refresh of the decision analytics"""
+
+    def test_01_late_write_is_counted(self):
+        """Test that a write stamped before a refresh but visible after it is picked up"""
+        async def run(overlap_seconds):
+            store = MemorySessionStore()
+            stats = DecisionStats(store, overlap_seconds=overlap_seconds)
+            await stats.refresh()
+            # Stamped before the refresh started, committed after its query ran
+            late = stats._refreshed_at - timedelta(seconds=1)
+            store._sessions["late"] = stored_session("late", late, alex="integrated_shield")
+            await stats.refresh()
+            return (await stats.get())["total_decisions"]
+
+        self.assertEqual(asyncio.run(run(overlap_seconds=5)), 1)
+        # Without the overlap only the hourly full rebuild would find it
+        self.assertEqual(asyncio.run(run(overlap_seconds=0)), 0)
+
+    def test_02_start_refreshes_in_the_background(self):
+        """Test that start() does not block and a concurrent get() reuses the first refresh"""
+        store = CountingStore()
+        store._sessions["s"] = stored_session("s", datetime.utcnow(), alex="medishield_basic")
+
+        async def run():
+            stats = DecisionStats(store, ttl_seconds=60)
+            stats.start()
+            self.assertIsNone(stats._summary)
+            summary = await stats.get()
+            await stats.stop()
+            return summary
+
+        summary = asyncio.run(run())
+        self.assertEqual(summary["total_decisions"], 1)
+        self.assertEqual(summary["per_character"]["alex"]["plans"]["medishield_basic"]["count"], 1)
+        self.assertEqual(store.full_scans, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import asyncio
+import unittest
+
+import httpx
+from fastapi import FastAPI
+
+import metrics
+from metrics import MONGO_LATENCY, Counter, Histogram, InstrumentedCollection, MetricsMiddleware
+
+
+class MotorLikeCursor:
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.sorted_by = None
+
+    def sort(self, key, direction=1):
+        self.sorted_by = key
+        return self
+
+    async def to_list(self, length):
+        return list(self.documents)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            await asyncio.sleep(0)
+            yield document
+
+
+class MotorLikeCollection:
+    def __init__(self, name, documents=()):
+        self.name = name
+        self.documents = list(documents)
+
+    async def find_one(self, query):
+        return self.documents[0] if self.documents else None
+
+    def find(self, query=None):
+        return MotorLikeCursor(self.documents)
+
+    def aggregate(self, pipeline):
+        return MotorLikeCursor([{"count": len(self.documents)}])
+
+
+class TestMetricTypes(unittest.TestCase):
+    """Prometheus text rendering"""
+
+    def test_01_counter(self):
+        counter = Counter("things_total", "Things.", ("kind",))
+        counter.inc("a")
+        counter.inc("a", amount=2)
+        self.assertEqual(counter.value("a"), 3.0)
+        self.assertEqual(counter.render(), [
+            "# HELP things_total Things.",
+            "# TYPE things_total counter",
+            'things_total{kind="a"} 3.0',
+        ])
+
+    def test_02_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+        self.assertEqual(histogram.count(), 3)
+        self.assertEqual(histogram.render()[2:], [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+        ])
+
+
+class TestInstrumentedCollection(unittest.TestCase):
+    """Mongo latency recorded per collection and operation"""
+
+    def test_01_timed_operations(self):
+        collection = InstrumentedCollection(MotorLikeCollection("timed_ops", [{"a": 1}]))
+        self.assertEqual(asyncio.run(collection.find_one({})), {"a": 1})
+        self.assertEqual(MONGO_LATENCY.count("timed_ops", "find_one"), 1)
+        # Attributes that are not operations pass straight through
+        self.assertEqual(collection.name, "timed_ops")
+
+    def test_02_cursor_reads(self):
+        """Test that find and aggregate are timed through to_list and iteration"""
+        collection = InstrumentedCollection(MotorLikeCollection("cursor_ops", [{"a": 1}, {"a": 2}]))
+
+        async def run():
+            cursor = collection.find({}).sort("a", -1)
+            # Chained calls keep the proxy
+            self.assertIsInstance(cursor, metrics.InstrumentedCursor)
+            self.assertEqual(await cursor.to_list(None), [{"a": 1}, {"a": 2}])
+            self.assertEqual(MONGO_LATENCY.count("cursor_ops", "find"), 1)
+
+            documents = [document async for document in collection.find({})]
+            self.assertEqual(len(documents), 2)
+            # One observation per fully read cursor, not per document
+            self.assertEqual(MONGO_LATENCY.count("cursor_ops", "find"), 2)
+
+            rows = [row async for row in collection.aggregate([])]
+            self.assertEqual(rows, [{"count": 2}])
+            self.assertEqual(MONGO_LATENCY.count("cursor_ops", "aggregate"), 1)
+
+        asyncio.run(run())
+
+
+class TestMetricsMiddleware(unittest.TestCase):
+    """Per-route request metrics"""
+
+    def test_01_route_labels(self):
+        """Test that requests are labelled by route template"""
+        app = FastAPI()
+
+        @app.get("/api/items/{item_id}")
+        async def get_item(item_id: str):
+            return {"id": item_id}
+
+        @app.get("/api/broken")
+        async def broken():
+            raise RuntimeError("boom")
+
+        app.add_middleware(MetricsMiddleware)
+
+        async def run():
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                self.assertEqual((await client.get("/api/items/abc")).status_code, 200)
+                self.assertEqual((await client.get("/api/items/def")).status_code, 200)
+                self.assertEqual((await client.get("/api/broken")).status_code, 500)
+                self.assertEqual((await client.get("/nowhere")).status_code, 404)
+
+        asyncio.run(run())
+        self.assertEqual(metrics.HTTP_REQUESTS.value("GET", "/api/items/{item_id}", "200"), 2)
+        self.assertEqual(metrics.HTTP_LATENCY.count("GET", "/api/items/{item_id}"), 2)
+        self.assertEqual(metrics.HTTP_ERRORS.value("GET", "/api/broken"), 1)
+        self.assertGreaterEqual(metrics.HTTP_REQUESTS.value("GET", "unmatched", "404"), 1)
+        self.assertEqual(metrics.HTTP_IN_PROGRESS.value("GET"), 0)
+
+        body = metrics.REGISTRY.render()
+        self.assertNotIn("/api/items/abc", body)
+        self.assertIn('http_requests_total{method="GET",route="/api/items/{item_id}",status="200"} 2.0', body)
+
+
+if __name__ == "__main__":
+    unittest.main()
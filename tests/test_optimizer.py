@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import optimizer
+from optimizer import pareto_front, score_grid
+
+COSTS = np.array([2000.0, 150000.0])
+PROBABILITIES = np.array([0.3, 0.02])
+
+
+class TestParetoFront(unittest.TestCase):
+    """Non-dominated point selection"""
+
+    def test_01_front(self):
+        premium = np.array([100.0, 200.0, 150.0, 300.0, 200.0])
+        out_of_pocket = np.array([50.0, 20.0, 60.0, 10.0, 30.0])
+        # 2 costs more and saves less than 0; 4 ties 1 on premium but saves less
+        self.assertEqual(pareto_front(premium, out_of_pocket).tolist(), [0, 1, 3])
+
+
+class TestScoreGrid(unittest.TestCase):
+    """Candidate pricing and scoring"""
+
+    def score(self, **kwargs):
+        return score_grid(
+            np.array([0.0, 1000.0, 2000.0]),
+            np.array([0.0, 10.0]),
+            np.array([20000.0, 100000.0, 200000.0]),
+            COSTS,
+            PROBABILITIES,
+            **kwargs,
+        )
+
+    def test_01_without_risk_loading_every_candidate_is_on_one_line(self):
+        """Test the degenerate pricing the risk charge exists to avoid"""
+        scores = self.score(loading=0.25, risk_loading=0.0)
+        expected_cost = COSTS @ PROBABILITIES
+        total = scores["annual_premium"] / 1.25 + scores["expected_out_of_pocket"]
+        np.testing.assert_allclose(total, expected_cost)
+
+    def test_02_dominated_candidate(self):
+        """Test that a design leaving the insurer the volatile tail can be dominated"""
+        scores = score_grid(
+            np.array([0.0, 2000.0]),
+            np.array([0.0]),
+            np.array([100000.0, 1000000.0]),
+            np.array([2000.0, 1000000.0]),
+            np.array([0.5, 0.001]),
+            loading=0.25,
+            risk_loading=0.1,
+        )
+        premium, out_of_pocket = scores["annual_premium"], scores["expected_out_of_pocket"]
+        # Grid order is (deductible, copay, limit)
+        small_claims, catastrophe = 0, 3
+        self.assertEqual(scores["annual_deductible"][small_claims], 0.0)
+        self.assertEqual(scores["coverage_limit"][small_claims], 100000.0)
+        self.assertEqual(scores["annual_deductible"][catastrophe], 2000.0)
+        self.assertEqual(scores["coverage_limit"][catastrophe], 1000000.0)
+
+        # Covering the frequent claim saves more on average than covering the
+        # rare one, and its steady payout carries a much smaller risk charge
+        self.assertLess(premium[small_claims], premium[catastrophe])
+        self.assertLess(out_of_pocket[small_claims], out_of_pocket[catastrophe])
+        self.assertNotIn(catastrophe, pareto_front(premium, out_of_pocket).tolist())
+        # The risk charge makes premium plus out-of-pocket differ between designs
+        self.assertGreater(np.ptp(premium + out_of_pocket), 1.0)
+
+    def test_03_blocks_match_a_single_pass(self):
+        """Test that accumulating scenarios in blocks gives the same scores"""
+        whole = self.score()
+        with mock.patch.object(optimizer, "BLOCK_CELLS", 1):
+            blocked = self.score()
+        for name in whole:
+            np.testing.assert_allclose(blocked[name], whole[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,430 @@
+import asyncio
+import copy
+import unittest
+from datetime import datetime
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import game_events
+from metrics import SESSION_WRITE_CONFLICTS
+from session_cache import SessionCache
+
+
+def matches(document, query):
+    """The subset of Mongo query matching the session cache uses."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, q) for q in condition):
+                return False
+            continue
+        value = document.get(key)
+        if isinstance(condition, dict):
+            for op, arg in condition.items():
+                if op == "$in":
+                    ok = value in arg
+                elif op == "$gt":
+                    ok = value is not None and value > arg
+                elif op == "$gte":
+                    ok = value is not None and value >= arg
+                elif op == "$not":
+                    ok = not matches(document, {key: arg})
+                else:
+                    raise NotImplementedError(op)
+                if not ok:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction=1):
+        self.documents.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.documents
+
+
+class FakeCollection:
+    """In-memory stand-in for the Motor collections behind the session cache."""
+
+    def __init__(self, *documents, delay=0.0):
+        self.documents = [copy.deepcopy(d) for d in documents]
+        self.delay = delay
+        self.find_one_calls = 0
+        # Number of upcoming insert_many calls that fail outright
+        self.fail_inserts = 0
+
+    async def find_one(self, query):
+        self.find_one_calls += 1
+        await asyncio.sleep(self.delay)
+        return next((copy.deepcopy(d) for d in self.documents if matches(d, query)), None)
+
+    def find(self, query, projection=None):
+        return FakeCursor([copy.deepcopy(d) for d in self.documents if matches(d, query)])
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(self.delay)
+        if self.fail_inserts:
+            self.fail_inserts -= 1
+            raise AutoReconnect("connection reset")
+        ids = {d["_id"] for d in self.documents}
+        errors = []
+        for index, document in enumerate(documents):
+            if document["_id"] in ids:
+                errors.append({"index": index, "code": 11000})
+            else:
+                ids.add(document["_id"])
+                self.documents.append(copy.deepcopy(document))
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            for document in self.documents:
+                if matches(document, operation._filter):
+                    document.update(copy.deepcopy(operation._doc["$set"]))
+                    for field in operation._doc.get("$currentDate", {}):
+                        document[field] = datetime.utcnow()
+
+
+def session(session_id, **fields):
+    return {
+        "session_id": session_id,
+        "characters": [
+            {"id": "alex", "name": "Alex", "insurance_choice": None},
+            {"id": "jamie", "name": "Jamie", "insurance_choice": None},
+        ],
+        "completed_decisions": {},
+        **fields,
+    }
+
+
+class TestSessionCacheEviction(unittest.TestCase):
+    """LRU bound, idle eviction and write-back of cached sessions"""
+
+    def test_01_size_bound(self):
+        """Test that the least recently used sessions are evicted beyond max_size"""
+        states = FakeCollection(session("a"), session("b"), session("c"))
+
+        async def run():
+            cache = SessionCache(states, FakeCollection(), max_size=2)
+            await cache.get("a")
+            await cache.get("b")
+            # Reading a makes b the least recently used
+            await cache.get("a")
+            await cache.get("c")
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(list(cache._entries), ["a", "c"])
+
+            # An evicted session loads again from Mongo
+            calls = states.find_one_calls
+            await cache.get("b")
+            self.assertEqual(states.find_one_calls, calls + 1)
+            self.assertEqual(len(cache), 2)
+
+        asyncio.run(run())
+
+    def test_02_idle_eviction(self):
+        """Test that sessions idle for idle_seconds are evicted"""
+        async def run():
+            cache = SessionCache(FakeCollection(), FakeCollection(), idle_seconds=0.05)
+            cache.put(session("idle"))
+            await asyncio.sleep(0.1)
+            cache.put(session("recent"))
+            cache.evict_idle()
+            self.assertEqual(list(cache._entries), ["recent"])
+
+        asyncio.run(run())
+
+    def test_03_dirty_sessions_are_not_evicted(self):
+        """Test that sessions with unwritten changes survive both kinds of eviction"""
+        states = FakeCollection(session("dirty"))
+
+        async def run():
+            cache = SessionCache(states, FakeCollection(), max_size=1, idle_seconds=0.05)
+            self.assertTrue(await cache.record_decision("dirty", "alex", "integrated_shield"))
+            cache.put(session("clean"))
+            # The clean session is evicted in its place
+            self.assertEqual(list(cache._entries), ["dirty"])
+
+            await asyncio.sleep(0.1)
+            cache.evict_idle()
+            self.assertIn("dirty", cache._entries)
+
+            # Events written but not yet snapshotted still count as dirty
+            await cache.flush()
+            cache.evict_idle()
+            self.assertIn("dirty", cache._entries)
+
+            await cache.snapshot()
+            cache.evict_idle()
+            self.assertNotIn("dirty", cache._entries)
+
+        asyncio.run(run())
+
+    def test_04_stop_writes_everything(self):
+        """Test that stop() flushes pending events and snapshots them"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+
+        async def run():
+            cache = SessionCache(states, events, flush_interval=60, snapshot_interval=60)
+            cache.start()
+            await cache.record_decision("s", "alex", "integrated_shield")
+            await cache.record_decision("s", "jamie", "medishield_basic")
+            self.assertEqual(events.documents, [])
+            await cache.stop()
+
+        asyncio.run(run())
+        self.assertEqual([e["seq"] for e in events.documents], [1, 2])
+        stored = states.documents[0]
+        self.assertEqual(stored["snapshot_seq"], 2)
+        self.assertEqual(stored["completed_decisions"], {"alex": "integrated_shield", "jamie": "medishield_basic"})
+
+
+class TestSessionReadCoalescing(unittest.TestCase):
+    """Single-flight session reads"""
+
+    def test_01_concurrent_reads_share_one_lookup(self):
+        """Test that concurrent reads of one session issue a single find_one"""
+        states = FakeCollection(session("coalesced"), delay=0.05)
+
+        async def run():
+            cache = SessionCache(states, FakeCollection())
+            results = await asyncio.gather(*(cache.get("coalesced") for _ in range(5)))
+            self.assertEqual(states.find_one_calls, 1)
+            self.assertTrue(all(r is results[0] for r in results))
+            self.assertEqual(results[0]["session_id"], "coalesced")
+
+            # Later reads are served from the cache
+            self.assertIs(await cache.get("coalesced"), results[0])
+            self.assertEqual(states.find_one_calls, 1)
+
+        asyncio.run(run())
+
+    def test_02_missing_sessions(self):
+        """Test coalesced and remembered lookups of unknown sessions"""
+        states = FakeCollection(delay=0.05)
+
+        async def run():
+            cache = SessionCache(states, FakeCollection(), miss_ttl=60)
+            results = await asyncio.gather(*(cache.get("unknown") for _ in range(3)))
+            self.assertEqual(results, [None, None, None])
+            self.assertEqual(states.find_one_calls, 1)
+
+            # Remembered for miss_ttl seconds
+            self.assertIsNone(await cache.get("unknown"))
+            self.assertEqual(states.find_one_calls, 1)
+
+            # Without a miss TTL every read after the first lookup queries again
+            cache = SessionCache(states, FakeCollection())
+            self.assertIsNone(await cache.get("unknown"))
+            self.assertIsNone(await cache.get("unknown"))
+            self.assertEqual(states.find_one_calls, 3)
+
+        asyncio.run(run())
+
+    def test_03_cancelled_reader(self):
+        """Test that a cancelled reader does not cancel the shared lookup"""
+        states = FakeCollection(session("coalesced"), delay=0.05)
+
+        async def run():
+            cache = SessionCache(states, FakeCollection())
+            first = asyncio.ensure_future(cache.get("coalesced"))
+            second = asyncio.ensure_future(cache.get("coalesced"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            document = await second
+            self.assertEqual(document["session_id"], "coalesced")
+            self.assertEqual(states.find_one_calls, 1)
+
+        asyncio.run(run())
+
+    def test_04_bulk_reads_join_single_reads(self):
+        """Test that get_many joins a lookup already in flight"""
+        states = FakeCollection(session("a"), session("b"), delay=0.05)
+
+        async def run():
+            cache = SessionCache(states, FakeCollection())
+            single = asyncio.ensure_future(cache.get("a"))
+            await asyncio.sleep(0)
+            documents = await cache.get_many(["a", "b"])
+            self.assertEqual(sorted(documents), ["a", "b"])
+            self.assertIs(documents["a"], await single)
+            self.assertEqual(states.find_one_calls, 1)
+
+        asyncio.run(run())
+
+
+class TestSessionEvents(unittest.TestCase):
+    """Decision events, snapshots and replay"""
+
+    def test_01_flush_appends_events(self):
+        """Test that decisions become numbered events on flush"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.record_decision("s", "alex", "integrated_shield")
+            await cache.record_decision("s", "alex", "medishield_basic")
+            self.assertFalse(await cache.record_decision("s", "nobody", "medishield_basic"))
+            await cache.flush()
+
+        asyncio.run(run())
+        self.assertEqual([e["_id"] for e in events.documents], ["s:1", "s:2"])
+        self.assertEqual(events.documents[1]["insurance_option_id"], "medishield_basic")
+        # Flushing does not touch the snapshot
+        self.assertNotIn("snapshot_seq", states.documents[0])
+
+    def test_02_snapshot_folds_events(self):
+        """Test that a snapshot writes the state and its snapshot_seq"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.record_decision("s", "alex", "integrated_shield")
+            # Not snapshotted before its events are written
+            await cache.snapshot()
+            self.assertNotIn("snapshot_seq", states.documents[0])
+
+            await cache.checkpoint()
+            document = await cache.get("s")
+            self.assertEqual(document["snapshot_seq"], 1)
+
+        asyncio.run(run())
+        stored = states.documents[0]
+        self.assertEqual(stored["snapshot_seq"], 1)
+        self.assertEqual(stored["completed_decisions"], {"alex": "integrated_shield"})
+        self.assertEqual(stored["characters"][0]["insurance_choice"], "integrated_shield")
+        self.assertIsInstance(stored["updated_at"], datetime)
+
+    def test_03_snapshot_never_goes_back(self):
+        """Test that an older copy does not overwrite a newer stored snapshot"""
+        states = FakeCollection(session("s", snapshot_seq=5, completed_decisions={"jamie": "integrated_shield"}))
+
+        async def run():
+            cache = SessionCache(states, FakeCollection())
+            cache.put(session("s", snapshot_seq=1))
+            await cache.record_decision("s", "alex", "medishield_basic")
+            await cache.checkpoint()
+
+        asyncio.run(run())
+        self.assertEqual(states.documents[0]["snapshot_seq"], 5)
+        self.assertEqual(states.documents[0]["completed_decisions"], {"jamie": "integrated_shield"})
+
+    def test_04_load_replays_events_after_snapshot(self):
+        """Test that a fresh cache sees the snapshot plus the later events"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.record_decision("s", "alex", "integrated_shield")
+            await cache.checkpoint()
+            await cache.record_decision("s", "jamie", "medishield_basic")
+            await cache.record_decision("s", "alex", "medishield_basic")
+            # Events written, snapshot still at seq 1, e.g. the process stopped here
+            await cache.flush()
+
+            fresh = SessionCache(states, events)
+            document = await fresh.get("s")
+            self.assertEqual(document["snapshot_seq"], 1)
+            self.assertEqual(game_events.event_seq(document), 3)
+            self.assertEqual(document["completed_decisions"], {"alex": "medishield_basic", "jamie": "medishield_basic"})
+
+            # The next decision continues the numbering and the replayed events get snapshotted
+            await fresh.record_decision("s", "jamie", "integrated_shield")
+            await fresh.checkpoint()
+
+        asyncio.run(run())
+        self.assertEqual([e["seq"] for e in events.documents], [1, 2, 3, 4])
+        self.assertEqual(states.documents[0]["snapshot_seq"], 4)
+        self.assertEqual(states.documents[0]["completed_decisions"], {"alex": "medishield_basic", "jamie": "integrated_shield"})
+
+    def test_05_failed_insert_is_retried_in_order(self):
+        """Test that events from a failed insert_many go back ahead of newer ones"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection(delay=0.05)
+        events.fail_inserts = 1
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.record_decision("s", "alex", "integrated_shield")
+            await cache.record_decision("s", "jamie", "integrated_shield")
+            flushing = asyncio.ensure_future(cache.flush())
+            await asyncio.sleep(0.01)
+            # Arrives while the failing write is in flight
+            await cache.record_decision("s", "alex", "medishield_basic")
+            await flushing
+            self.assertEqual(events.documents, [])
+            self.assertEqual([e["seq"] for e in cache._pending["s"]], [1, 2, 3])
+            # Still dirty, so it cannot be evicted and lose the events
+            cache.idle_seconds = 0
+            cache.evict_idle()
+            self.assertIn("s", cache._entries)
+
+            await cache.flush()
+
+        asyncio.run(run())
+        self.assertEqual([e["seq"] for e in events.documents], [1, 2, 3])
+
+    def test_06_retried_duplicate_is_not_a_conflict(self):
+        """Test that an event already written by an earlier attempt is accepted"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+        conflicts = SESSION_WRITE_CONFLICTS.value()
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.record_decision("s", "alex", "integrated_shield")
+            # The earlier attempt reached Mongo although the driver reported a failure
+            written = dict(cache._pending["s"][0])
+            events.documents.append(written)
+            await cache.checkpoint()
+
+        asyncio.run(run())
+        self.assertEqual(SESSION_WRITE_CONFLICTS.value(), conflicts)
+        self.assertEqual(len(events.documents), 1)
+        self.assertEqual(states.documents[0]["snapshot_seq"], 1)
+
+    def test_07_conflicting_event_triggers_rebase(self):
+        """Test that an event written by another process is kept and ours re-applied after it"""
+        states = FakeCollection(session("s"))
+        events = FakeCollection()
+        conflicts = SESSION_WRITE_CONFLICTS.value()
+
+        async def run():
+            cache = SessionCache(states, events)
+            await cache.get("s")
+            # Another process records a decision under the same sequence number
+            events.documents.append(game_events.decision_event("s", 1, "jamie", "integrated_shield"))
+            await cache.record_decision("s", "alex", "medishield_basic")
+            await cache.flush()
+            self.assertEqual(SESSION_WRITE_CONFLICTS.value(), conflicts + 1)
+
+            document = await cache.get("s")
+            self.assertEqual(document["completed_decisions"], {"jamie": "integrated_shield", "alex": "medishield_basic"})
+            self.assertEqual([e["seq"] for e in cache._pending["s"]], [2])
+            await cache.checkpoint()
+
+        asyncio.run(run())
+        self.assertEqual(
+            [(e["seq"], e["character_id"]) for e in events.documents],
+            [(1, "jamie"), (2, "alex")]
+        )
+        self.assertEqual(states.documents[0]["snapshot_seq"], 2)
+        self.assertEqual(
+            states.documents[0]["completed_decisions"],
+            {"jamie": "integrated_shield", "alex": "medishield_basic"}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()